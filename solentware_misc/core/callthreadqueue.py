@@ -7,45 +7,576 @@
 Methods are read from a queue and requests to run methods while the thread
 is running a method are rejected.
 
+Optionally several threads read methods from the queue, and the queue may
+hold more than one method, so independent methods can run at the same time.
+
+The TaskFuture returned for each method put on the queue gives the method's
+result or exception, and when it was queued, started, and finished.
+
+Methods are run in priority order, and a method put on the queue with the
+coalescing key of a method still on the queue replaces that method.
+
+A TaskToken passed to a method lets it be cancelled at the method's next
+checkpoint and lets it report progress.
+
+Coroutines can await methods run by the thread using submit().
+
+The threads are stopped by shutdown(), or on leaving a with statement, after
+running, or cancelling, the methods still on the queue.
+
+A TaskMetrics instance records how long methods waited and ran, their
+outcome, and the number rejected because the queue was full.
+
 """
 import queue
 import threading
+import sys
+import time
+import heapq
+import itertools
+import asyncio
+import collections
+import bisect
+from concurrent import futures
+
+# Marks a TaskQueue entry replaced by a later entry with the same key.
+_REPLACED = object()
+
+# Priority of the entries put by TaskQueue.close() to stop the threads.
+_STOP_PRIORITY = float("inf")
+
+# Upper bounds, in seconds, of the buckets in TaskMetrics histograms.  The
+# last bucket counts times above the last bound.
+HISTOGRAMBOUNDS = (0.001, 0.01, 0.1, 1, 10, 100)
+
+# Outcomes recorded by TaskMetrics.
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+REJECTED = "rejected"
+
+
+class TaskCancelled(Exception):
+    """Raised by TaskToken.check() when the task has been cancelled."""
+
+
+class TaskToken:
+    """Cancellation request and progress reports for a running method.
+
+    The method calls check(), or tests cancelled, at convenient points and
+    stops if cancel() has been called, perhaps by another thread.
+
+    """
+
+    def __init__(self, reporter=None, interval=0.5):
+        """Create token with optional reporter of progress.
+
+        reporter - called as reporter(fraction, message) by report().
+        interval - minimum seconds between calls of reporter.
+
+        """
+        self._cancel_event = threading.Event()
+        self._reporter = reporter
+        self.interval = interval
+        self._reported_time = None
+        self.fraction = None
+        self.message = None
+
+    def cancel(self):
+        """Ask the method using the token to stop."""
+        self._cancel_event.set()
+
+    @property
+    def cancelled(self):
+        """Return True if cancel() has been called."""
+        return self._cancel_event.is_set()
+
+    def check(self):
+        """Raise TaskCancelled if cancel() has been called."""
+        if self._cancel_event.is_set():
+            raise TaskCancelled("Task cancelled")
+
+    def report(self, fraction, message=None):
+        """Note progress and pass it to the reporter if due, return cancelled.
+
+        fraction - proportion of task done, 0 to 1.
+        message - optional text describing progress.
+
+        The reporter is called at most once per interval, except it is
+        always called when fraction reaches 1.
+
+        """
+        self.fraction = fraction
+        self.message = message
+        if self._reporter is not None:
+            now = time.monotonic()
+            if (
+                self._reported_time is None
+                or now - self._reported_time >= self.interval
+                or fraction >= 1
+            ):
+                self._reported_time = now
+                self._reporter(fraction, message)
+        return self._cancel_event.is_set()
+
+
+class TaskMetrics:
+    """Record queue wait, run time, and outcome, of recent tasks.
+
+    The latest history tasks are kept for the histograms given by stats().
+    Counts of outcomes, including tasks rejected because the queue was full,
+    are kept for all tasks.
+
+    """
+
+    def __init__(self, history=1000, callback=None):
+        """Create empty record of tasks.
+
+        history - number of recent tasks kept for histograms.
+        callback - called with a dict of name, outcome, wait, and run, for
+        each task recorded.  wait and run are None if not known.
+
+        """
+        self._lock = threading.Lock()
+        self._recent = collections.deque(maxlen=history)
+        self._outcomes = collections.Counter()
+        self.callback = callback
+
+    def record(self, future):
+        """Record the outcome of future, a done TaskFuture.
+
+        A method stopped by TaskCancelled, from TaskToken.check(), is
+        recorded as cancelled rather than failed.
+
+        """
+        if future.cancelled() or isinstance(future.exception(), TaskCancelled):
+            outcome = CANCELLED
+        elif future.exception() is not None:
+            outcome = FAILED
+        else:
+            outcome = DONE
+        self._add(future.name, outcome, future.wait_time(), future.run_time())
+
+    def reject(self, name):
+        """Record rejection of task name because the queue was full."""
+        self._add(name, REJECTED, None, None)
+
+    def _add(self, name, outcome, wait, run):
+        """Add task to record and call callback."""
+        with self._lock:
+            self._outcomes[outcome] += 1
+            self._recent.append((name, outcome, wait, run))
+        if self.callback is not None:
+            self.callback(dict(name=name, outcome=outcome, wait=wait, run=run))
+
+    def stats(self):
+        """Return dict summarising the recorded tasks.
+
+        outcomes - count of each outcome for all tasks.
+        recent - number of recent tasks summarised in wait, run, and names.
+        bounds - HISTOGRAMBOUNDS.
+        wait and run - dicts of count, total, max, and histogram, of times
+        in seconds, where histogram[i] counts times up to bounds[i] not
+        counted in an earlier bucket.
+        names - dict of task name to count and total run time.
+
+        """
+        with self._lock:
+            recent = list(self._recent)
+            outcomes = dict(self._outcomes)
+        names = {}
+        for name, _, _, run in recent:
+            entry = names.setdefault(name, dict(count=0, run=0.0))
+            entry["count"] += 1
+            if run is not None:
+                entry["run"] += run
+        return dict(
+            outcomes=outcomes,
+            recent=len(recent),
+            bounds=HISTOGRAMBOUNDS,
+            wait=_summarise_times(r[2] for r in recent),
+            run=_summarise_times(r[3] for r in recent),
+            names=names,
+        )
+
+
+def _summarise_times(times):
+    """Return dict of count, total, max, and histogram, of times not None."""
+    histogram = [0] * (len(HISTOGRAMBOUNDS) + 1)
+    count = 0
+    total = 0.0
+    longest = None
+    for seconds in times:
+        if seconds is None:
+            continue
+        histogram[bisect.bisect_left(HISTOGRAMBOUNDS, seconds)] += 1
+        count += 1
+        total += seconds
+        if longest is None or seconds > longest:
+            longest = seconds
+    return dict(count=count, total=total, max=longest, histogram=histogram)
+
+
+class TaskFuture(futures.Future):
+    """Future for a method run by CallThreadQueue with it's timings.
+
+    The times are time.perf_counter() values, None until the event occurs.
+
+    """
+
+    def __init__(self, name=None):
+        """Create future and note the time it is queued.
+
+        name - name of the task, used by TaskMetrics.
+
+        """
+        super().__init__()
+        self.name = name
+        self.queued_time = time.perf_counter()
+        self.start_time = None
+        self.end_time = None
+
+    def run(self, method, args, kwargs):
+        """Run method(*args, **kwargs) and set the future's outcome.
+
+        The method is not run if the future was cancelled while queued.
+
+        """
+        if not self.set_running_or_notify_cancel():
+            return
+        self.start_time = time.perf_counter()
+        try:
+            result = method(*args, **kwargs)
+        except BaseException as exc:
+            self.end_time = time.perf_counter()
+            self.set_exception(exc)
+            if not isinstance(exc, Exception):
+                raise
+        else:
+            self.end_time = time.perf_counter()
+            self.set_result(result)
+
+    def wait_time(self):
+        """Return seconds from queueing to start of run, or None."""
+        if self.start_time is None:
+            return None
+        return self.start_time - self.queued_time
+
+    def run_time(self):
+        """Return seconds taken to run method, or None if not finished."""
+        if self.end_time is None:
+            return None
+        return self.end_time - self.start_time
+
+
+def _cancel_entry(item):
+    """Cancel the TaskFuture of a queue entry made by put_method."""
+    # The method of an entry made by put_method is <TaskFuture>.run.
+    future = getattr(item[0], "__self__", None)
+    if isinstance(future, TaskFuture):
+        future.cancel()
+
+
+class TaskQueue(queue.Queue):
+    """Queue ordered by priority where entries may replace earlier entries.
+
+    Entries with lower priority values are got first, and entries of equal
+    priority in the order they were put.  An entry put with the same key as
+    an entry still on the queue replaces that entry.
+
+    Nothing can be put on the queue after close() is called.
+
+    """
+
+    def _init(self, maxsize):
+        """Create the heap of [priority, sequence, key, item] entries."""
+        self.queue = []
+        self._pending = {}
+        self._replaced = 0
+        self._sequence = itertools.count()
+        self.closed = False
+
+    def close(self, count, discard=False):
+        """Put count None entries after all others and refuse later entries.
+
+        count - number of None entries, usually one per thread reading the
+        queue.
+        discard - if True remove the entries on the queue.
+
+        Space on the queue is not needed for the None entries.  The items
+        removed are returned in the order they would have been got.
+
+        """
+        with self.mutex:
+            discarded = []
+            if discard:
+                discarded = [
+                    entry[-1]
+                    for entry in sorted(self.queue)
+                    if entry[-1] is not _REPLACED
+                ]
+                self.queue.clear()
+                self._pending.clear()
+                self._replaced = 0
+                self.unfinished_tasks -= len(discarded)
+                if not self.unfinished_tasks:
+                    self.all_tasks_done.notify_all()
+            self.closed = True
+            for _ in range(count):
+                heapq.heappush(
+                    self.queue,
+                    [_STOP_PRIORITY, next(self._sequence), None, None],
+                )
+                self.unfinished_tasks += 1
+            self.not_empty.notify_all()
+            self.not_full.notify_all()
+            return discarded
+
+    def _qsize(self):
+        """Return number of entries excluding replaced entries."""
+        return len(self.queue) - self._replaced
+
+    def _put(self, item):
+        """Put item with default priority and no key."""
+        heapq.heappush(self.queue, [0, next(self._sequence), None, item])
+
+    def _get(self):
+        """Return item from first entry which has not been replaced."""
+        while True:
+            _, _, key, item = heapq.heappop(self.queue)
+            if item is not _REPLACED:
+                break
+            self._replaced -= 1
+        if key is not None:
+            del self._pending[key]
+        return item
+
+    def _wait_for_space(self, block, timeout):
+        """Wait for space on the queue as queue.Queue.put does.
+
+        Must be called with not_full held.
+
+        """
+        if not block:
+            if self._qsize() >= self.maxsize:
+                raise queue.Full
+        elif timeout is None:
+            while self._qsize() >= self.maxsize:
+                self.not_full.wait()
+        elif timeout < 0:
+            raise ValueError("'timeout' must be a non-negative number")
+        else:
+            endtime = time.monotonic() + timeout
+            while self._qsize() >= self.maxsize:
+                remaining = endtime - time.monotonic()
+                if remaining <= 0.0:
+                    raise queue.Full
+                self.not_full.wait(remaining)
+
+    def put(self, item, block=True, timeout=None, priority=0, key=None):
+        """Put item on queue and return the item it replaced, or None.
+
+        item - the entry.
+        block - wait for space on the queue if True.
+        timeout - seconds to wait for space, None means wait for ever.
+        priority - lower values are got first, default 0.
+        key - item replaces an item on the queue with the same key, default
+        None meaning no replacement.
+
+        Space is needed only if there is no item to replace.  queue.Full is
+        raised if there is no space when block is False or after timeout.
+        RuntimeError is raised if the queue is closed.
+
+        """
+        with self.not_full:
+            if self.closed:
+                raise RuntimeError("Cannot put entry on closed TaskQueue")
+            if self.maxsize > 0 and key not in self._pending:
+                self._wait_for_space(block, timeout)
+            if self.closed:
+                raise RuntimeError("Cannot put entry on closed TaskQueue")
+            replaced = None
+            if key is not None and key in self._pending:
+                entry = self._pending[key]
+                replaced = entry[-1]
+                entry[-1] = _REPLACED
+                self._replaced += 1
+            else:
+                self.unfinished_tasks += 1
+            entry = [priority, next(self._sequence), key, item]
+            heapq.heappush(self.queue, entry)
+            if key is not None:
+                self._pending[key] = entry
+            self.not_empty.notify()
+            return replaced
 
 
 class CallThreadQueue:
     """Provide a queue and a thread which runs methods placed on the queue.
 
-    The maximum size of the queue is one.
+    By default there is one thread and the maximum size of the queue is one.
+
+    Use as a context manager to call shutdown() on leaving the with statement.
 
     """
 
-    def __init__(self):
-        """Create the queue and start the thread."""
+    def __init__(self, *, workers=1, maxsize=1, metrics=None):
+        """Create the queue and start the threads.
+
+        workers - number of threads running methods from the queue.
+        maxsize - maximum size of the queue, 0 means no limit.
+        metrics - TaskMetrics instance recording tasks, default a new one.
+
+        """
         super().__init__()
-        self.queue = queue.Queue(maxsize=1)
-        threading.Thread(target=self.__call_method, daemon=True).start()
+        if workers < 1:
+            raise ValueError(
+                "".join(
+                    (
+                        "CallThreadQueue needs at least 1 worker but ",
+                        str(workers),
+                        " requested",
+                    )
+                )
+            )
+        self.queue = TaskQueue(maxsize=maxsize)
+        self.metrics = TaskMetrics() if metrics is None else metrics
+        self.workers = workers
+        self._running = workers
+        self._running_lock = threading.Lock()
+        self._threads = [
+            threading.Thread(target=self.__call_method, daemon=True)
+            for _ in range(workers)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def __enter__(self):
+        """Return self."""
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        """Run methods still on the queue then stop the threads."""
+        self.shutdown()
+
+    def shutdown(self, wait=True, timeout=None, cancel_pending=False):
+        """Stop the threads when the methods on the queue have been run.
+
+        wait - if True wait for the threads to stop.
+        timeout - maximum seconds to wait, None means wait for ever.
+        cancel_pending - if True cancel methods on the queue rather than run
+        them.  Running methods are not interrupted.
+
+        A None entry is put on the queue for each thread, after all the
+        methods on the queue, and later put_method calls raise RuntimeError.
+
+        Return True if all the threads have stopped.
+
+        """
+        tasks = self.queue
+        if tasks is not None and not tasks.closed:
+            for item in tasks.close(self.workers, discard=cancel_pending):
+                _cancel_entry(item)
+        if wait:
+            deadline = None if timeout is None else time.monotonic() + timeout
+            for thread in self._threads:
+                if deadline is None:
+                    thread.join()
+                else:
+                    thread.join(max(0, deadline - time.monotonic()))
+        return not any(thread.is_alive() for thread in self._threads)
 
     def __call_method(self):
-        """Get method from queue, run it, and then wait for next method."""
+        """Get method from queue, run it, and then wait for next method.
+
+        The thread stops when an entry which is not a method and it's
+        arguments is read, and the queue is discarded when the last thread
+        stops.  An exception raised by the method is reported by
+        sys.excepthook and the thread continues.
+
+        """
+        tasks = self.queue
         while True:
             try:
-                method, args, kwargs = self.queue.get()
+                method, args, kwargs = tasks.get()
             except:
-                self.queue.task_done()
-                self.queue = None
+                with self._running_lock:
+                    self._running -= 1
+                    if not self._running:
+                        self.queue = None
+                tasks.task_done()
                 break
-            method(*args, **kwargs)
-            self.queue.task_done()
+            try:
+                method(*args, **kwargs)
+            except Exception:
+                # Report as an uncaught exception but keep the thread.
+                sys.excepthook(*sys.exc_info())
+            tasks.task_done()
+
+    def stats(self):
+        """Return TaskMetrics.stats() for the tasks run by the threads."""
+        return self.metrics.stats()
+
+    async def submit(self, method, *args, **kwargs):
+        """Run method(*args, **kwargs) in the thread and return it's result.
+
+        The method is put on the queue without waiting for space, so
+        queue.Full is raised rather than blocking the event loop.
 
-    def put_method(self, method, args=(), kwargs=None):
+        """
+        return await asyncio.wrap_future(
+            self.put_method(method, args, kwargs, block=False)
+        )
+
+    def put_method(
+        self,
+        method,
+        args=(),
+        kwargs=None,
+        priority=0,
+        key=None,
+        block=True,
+        name=None,
+    ):
         """Append the method and it's arguments to the queue.
 
         method - the method to be run.
         args - passed to method as *args.
         kwargs - passed to method as **kwargs.
+        priority - methods with lower values are run first, default 0.
+        key - method replaces, and cancels the TaskFuture of, a method on the
+        queue with the same key, default None meaning no replacement.
+        block - if False raise queue.Full rather than wait for space.
+        name - name of task in metrics, default the method's qualified name.
 
         The entry is a tuple:
 
-        (method, args, kwargs).
+        (<TaskFuture>.run, (method, args, kwargs), {}).
+
+        The TaskFuture is returned.  It's callbacks are called in the thread
+        which runs method.
         """
-        self.queue.put((method, args, {} if kwargs is None else kwargs))
+        tasks = self.queue
+        if tasks is None:
+            raise RuntimeError("Cannot put method when threads have stopped")
+        if name is None:
+            name = getattr(method, "__qualname__", repr(method))
+        future = TaskFuture(name=name)
+        try:
+            replaced = tasks.put(
+                (
+                    future.run,
+                    (method, args, {} if kwargs is None else kwargs),
+                    {},
+                ),
+                block=block,
+                priority=priority,
+                key=key,
+            )
+        except queue.Full:
+            self.metrics.reject(name)
+            raise
+        future.add_done_callback(self.metrics.record)
+        if replaced is not None:
+            _cancel_entry(replaced)
+        return future
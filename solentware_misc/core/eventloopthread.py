@@ -0,0 +1,62 @@
+# eventloopthread.py
+# Copyright 2026 Roger Marsh
+# Licence: See LICENCE (BSD licence)
+
+"""Provide the EventLoopThread class to run coroutines in a thread.
+
+An asyncio event loop runs in a dedicated thread so many coroutines waiting
+for input or output share the thread, while the main thread runs the user
+interface.
+
+"""
+
+import asyncio
+import threading
+
+
+class EventLoopThread:
+    """Provide an asyncio event loop running in a thread."""
+
+    def __init__(self):
+        """Create the event loop and start the thread running it."""
+        super().__init__()
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self.__run_loop, daemon=True)
+        self._thread.start()
+
+    def __run_loop(self):
+        """Run the event loop until stop() is called then close it.
+
+        Tasks not finished when the loop stops are cancelled.
+
+        """
+        asyncio.set_event_loop(self.loop)
+        try:
+            self.loop.run_forever()
+        finally:
+            tasks = asyncio.all_tasks(self.loop)
+            for task in tasks:
+                task.cancel()
+            self.loop.run_until_complete(
+                asyncio.gather(*tasks, return_exceptions=True)
+            )
+            self.loop.close()
+
+    def put_coroutine(self, coroutine):
+        """Schedule coroutine on the event loop from any thread.
+
+        A concurrent.futures.Future for the coroutine's result is returned.
+
+        """
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+
+    def stop(self, timeout=None):
+        """Stop the event loop and wait up to timeout seconds for thread.
+
+        Return True if the thread has finished.
+
+        """
+        if not self.loop.is_closed():
+            self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join(timeout)
+        return not self._thread.is_alive()
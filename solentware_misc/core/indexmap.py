@@ -4,124 +4,1843 @@
 
 """Provide the Segment class to manage a range of record numbers.
 
+The RecordSet class manages record numbers spread over many segments.
+
 This module is obsolete given existence of core.recordset module in
 solentware_base package, a sibling of solentware_misc.
 
 It is an inverted list bitmap manager in DPT style.  The database interface
 for DPT is available at www.solentware.co.uk.
 
+NumPy is used, if installed, to convert between bitmaps and lists of record
+numbers.  The answers are the same with or without NumPy.  NumPy is imported
+when first needed, not when this module is imported.
+
 """
 
+import sys
 import pickle
+import itertools
+import operator
+import bisect
+import threading
+import importlib
+from array import array
 
 MAPSIZE = 2040  # integers to represent DPT page size minus reserved bytes
 INTEGERSIZE = 32  # 32 bit integers
 SEGMENTSIZE = MAPSIZE * INTEGERSIZE  # DPT record numbers per segment
-SEGMENTRANGE = list(range(SEGMENTSIZE))
-BITMASK = [1 << x for x in range(INTEGERSIZE - 1)]
-BITMASK.append(~sum(BITMASK))  # 1 << INTEGERSIZE gives +ve Long Integer
 SEGMENTDELIMITER = chr(0)  # delimiter in <index><delimiter><segment>
+RUNSTYPECODE = "L"  # array typecode for run boundaries, at least 32 bits
+
+# Segment.add_many() and remove_many() change the bytes of a bitmap directly
+# for at most SEGMENTSIZE // SMALLBATCHDIVISOR record numbers.
+SMALLBATCHDIVISOR = 128
+
+# Versioned format of Segment.to_bytes() and Segment.from_bytes() values:
+# <FORMATVERSION><kind><body> where kind is one of FORMATBITMAP,
+# FORMATFIXEDLIST, or FORMATFIXEDRUNS.  FORMATVERSION must never be
+# pickle.PROTO, the first byte of the values produced by Segment.pickle_map().
+# Fixed-width numbers are little-endian unsigned integers of the smallest
+# of 2, 4, or 8, bytes able to hold SEGMENTSIZE.
+FORMATVERSION = 1
+FORMATBITMAP = 0  # body is little-endian bitmap with trailing zeros omitted
+FORMATFIXEDLIST = 5  # body is fixed-width record numbers in ascending order
+FORMATFIXEDRUNS = 6  # body is fixed-width run boundaries in ascending order
+
+# Changes since last save produced by Segment.delta() in the same layout,
+# <FORMATVERSION><kind><body>, where kind is one of FORMATDELTAWORDS or
+# FORMATDELTALIST.
+FORMATDELTAWORDS = 3  # body is varint (index difference, word) pairs
+FORMATDELTALIST = 4  # body is varint count then added then removed numbers
+
+# (itemsize, typecode) of array unsigned integer types in ascending size.
+_UNSIGNEDTYPECODES = sorted(
+    {array(typecode).itemsize: typecode for typecode in "QLIH"}.items()
+)
+
+# Map the characters of bin(<bitmap>) to bytes usable as itertools.compress
+# selectors: b"0" becomes 0 and b"1" becomes 1.
+_BINARY_DIGITS = bytes.maketrans(b"01", b"\x00\x01")
+
+
+def __getattr__(name):
+    """Return SEGMENTRANGE, BITMASK, or numpy, created on first use.
+
+    SEGMENTRANGE and BITMASK are no longer used by Segment, and importing
+    NumPy takes much longer than importing this module, so they are not
+    created at import time.
+
+    """
+    if name == "numpy":
+        return _get_numpy()
+    if name == "SEGMENTRANGE":
+        value = list(range(SEGMENTSIZE))
+    elif name == "BITMASK":
+        value = [1 << x for x in range(INTEGERSIZE - 1)]
+        value.append(~sum(value))  # 1 << INTEGERSIZE gives +ve Long Integer
+    else:
+        raise AttributeError(
+            "".join(
+                ("module ", repr(__name__), " has no attribute ", repr(name))
+            )
+        )
+    globals()[name] = value
+    return value
+
+
+def _get_numpy():
+    """Return the numpy module, imported on first call, or None.
+
+    None is returned if NumPy is not installed.  The module, or None, is
+    kept as the numpy attribute of this module.
+
+    """
+    if "numpy" not in globals():
+        try:
+            module = importlib.import_module("numpy")
+        except (
+            ImportError
+        ):  # NumPy is optional, bitmaps are decoded without it.
+            module = None
+        globals()["numpy"] = module
+    return globals()["numpy"]
+
+
+try:
+    _popcount = int.bit_count
+except AttributeError:  # Python earlier than 3.10.
+
+    def _popcount(value):
+        """Return number of 1 bits in value."""
+        return bin(value).count("1")
+
+
+def _bitmap_digits(bitmap):
+    """Return bytes where element n is 1 if bit n of bitmap is set, else 0.
+
+    bitmap is a non-negative int.  The bytes object stops at the highest
+    set bit so positions beyond it's length are not set.
+
+    """
+    return bin(bitmap)[:1:-1].encode().translate(_BINARY_DIGITS)
+
+
+def _bitmap_positions(bitmap):
+    """Return ascending list of positions of the 1 bits in bitmap.
+
+    bitmap is a non-negative int.  The work is done by numpy.unpackbits()
+    if NumPy is available, otherwise by bin(), bytes.translate(), and
+    itertools.compress(), rather than a bit at a time in Python code.
+
+    """
+    if not bitmap:
+        return []
+    if _get_numpy() is not None:
+        return _buffer_positions(
+            bitmap.to_bytes((bitmap.bit_length() + 7) // 8, "little")
+        )
+    digits = _bitmap_digits(bitmap)
+    return list(itertools.compress(range(len(digits)), digits))
+
+
+def _buffer_positions(buffer):
+    """Return ascending list of positions of the 1 bits in buffer.
+
+    buffer is a little-endian bitmap, such as the bytearray of a Segment
+    bitmap, which NumPy reads without a copy if available.
+
+    """
+    numpy = _get_numpy()
+    if numpy is not None:
+        return numpy.flatnonzero(
+            numpy.unpackbits(
+                numpy.frombuffer(buffer, dtype=numpy.uint8),
+                bitorder="little",
+            )
+        ).tolist()
+    return _bitmap_positions(int.from_bytes(buffer, "little"))
+
+
+def _bitmap_buffer(bitmap, size):
+    """Return bytearray holding bitmap, a non-negative int, little-endian.
+
+    size - number of bits in bitmap, SEGMENTSIZE of the Segment class.
+
+    """
+    return bytearray(bitmap.to_bytes(size // 8, "little"))
+
+
+def _bitmap_from_positions(positions, size):
+    """Return bitmap, a non-negative int, with the bits in positions set.
+
+    positions - an iterable of positions, a range is done by one slice
+    assignment.
+    size - number of bits in bitmap, SEGMENTSIZE of the Segment class.
+
+    """
+    numpy = _get_numpy()
+    if numpy is not None and not isinstance(positions, range):
+        bits = numpy.zeros(size, dtype=numpy.uint8)
+        bits[numpy.fromiter(positions, dtype=numpy.intp)] = 1
+        return int.from_bytes(
+            numpy.packbits(bits, bitorder="little").tobytes(), "little"
+        )
+    digits = bytearray(b"0") * size
+    if isinstance(positions, range):
+        digits[positions.start : positions.stop : positions.step] = b"1" * len(
+            positions
+        )
+    else:
+        for position in positions:
+            digits[position] = 0x31  # ord("1")
+    return int(digits[::-1], 2)
+
+
+def _as_bitmap(values, size):
+    """Return bitmap int for values in set, bitmap, or runs, representation.
+
+    size - number of bits in bitmap, SEGMENTSIZE of the Segment class.
+
+    """
+    if isinstance(values, set):
+        return _bitmap_from_positions(values, size)
+    if isinstance(values, array):
+        return _bitmap_from_runs(_run_pairs(values), size)
+    return int.from_bytes(values, "little")
+
+
+def _probe_bitmap(numbers, bitmap, present):
+    """Return set of members of numbers whose bit in bitmap is present.
+
+    numbers - a set of record numbers in a segment.
+    bitmap - a non-negative int.
+    present - True to select set bits, False to select clear bits.
+
+    """
+    digits = _bitmap_digits(bitmap)
+    size = len(digits)
+    if present:
+        return {n for n in numbers if n < size and digits[n]}
+    return {n for n in numbers if n >= size or not digits[n]}
+
+
+def _bitmap_from_runs(runs, size):
+    """Return bitmap, a non-negative int, with the bits in runs set.
+
+    runs - iterable of (start, stop) pairs like range(start, stop).
+    size - number of bits in bitmap, SEGMENTSIZE of the Segment class.
+
+    """
+    digits = bytearray(b"0") * size
+    for start, stop in runs:
+        digits[start:stop] = b"1" * (stop - start)
+    return int(digits[::-1], 2)
+
+
+def _runs_from_bitmap(bitmap):
+    """Return list of (start, stop) pairs of consecutive set bits in bitmap.
+
+    The bit at position start is the first in a run and the bit at position
+    stop is the first clear bit after it.
+
+    """
+    return list(
+        zip(
+            _bitmap_positions(bitmap & ~(bitmap << 1)),
+            _bitmap_positions((bitmap & ~(bitmap >> 1)) << 1),
+        )
+    )
+
+
+def _runs_from_numbers(numbers):
+    """Return list of (start, stop) pairs of consecutive numbers.
+
+    numbers - ascending sequence of record numbers without duplicates.
+
+    """
+    runs = []
+    start = stop = None
+    for number in numbers:
+        if number == stop:
+            stop += 1
+            continue
+        if start is not None:
+            runs.append((start, stop))
+        start = number
+        stop = number + 1
+    if start is not None:
+        runs.append((start, stop))
+    return runs
+
+
+def _runs_array(runs):
+    """Return array of start and stop boundaries from (start, stop) pairs."""
+    return array(RUNSTYPECODE, itertools.chain.from_iterable(runs))
+
+
+def _run_pairs(boundaries):
+    """Return iterator of (start, stop) pairs from array of boundaries."""
+    return zip(boundaries[::2], boundaries[1::2])
+
+
+def _encode_varints(numbers):
+    """Return bytearray of numbers encoded as 7 bits per byte varints."""
+    encoded = bytearray()
+    append = encoded.append
+    for number in numbers:
+        while number > 0x7F:
+            append(number & 0x7F | 0x80)
+            number >>= 7
+        append(number)
+    return encoded
+
+
+def _decode_varints(buffer):
+    """Return list of numbers decoded from varints in buffer."""
+    numbers = []
+    append = numbers.append
+    number = shift = 0
+    for byte in buffer:
+        number |= (byte & 0x7F) << shift
+        if byte & 0x80:
+            shift += 7
+        else:
+            append(number)
+            number = shift = 0
+    return numbers
+
+
+def _fixed_width_typecode(limit):
+    """Return typecode of smallest array unsigned type holding 0 to limit."""
+    for itemsize, typecode in _UNSIGNEDTYPECODES:
+        if not limit >> 8 * itemsize:
+            break
+    return typecode
+
+
+def _encode_fixed_width(numbers, limit):
+    """Return bytes of numbers as little-endian fixed-width integers.
+
+    limit - the largest number which can be encoded, which determines the
+    width.
+
+    """
+    encoded = array(_fixed_width_typecode(limit), numbers)
+    if sys.byteorder != "little":
+        encoded.byteswap()
+    return encoded.tobytes()
+
+
+def _decode_fixed_width(buffer, limit):
+    """Return array of numbers decoded from _encode_fixed_width() output."""
+    decoded = array(_fixed_width_typecode(limit))
+    decoded.frombytes(buffer)
+    if sys.byteorder != "little":
+        decoded.byteswap()
+    return decoded
+
+
+def _encode_ascending(numbers):
+    """Return varints of differences between ascending numbers."""
+    return _encode_varints(
+        map(operator.sub, numbers, itertools.chain((0,), numbers))
+    )
+
+
+def decode_delta(data):
+    """Return (kind, changes) decoded from data produced by Segment.delta().
+
+    kind is FORMATDELTAWORDS or FORMATDELTALIST.  changes is a list of
+    (word index, word) pairs for FORMATDELTAWORDS, and a tuple of the
+    lists of added and removed positions for FORMATDELTALIST.
+
+    """
+    view = memoryview(data)
+    if view[0] != FORMATVERSION:
+        raise ValueError(
+            "".join(
+                ("Segment format version ", str(view[0]), " is not supported")
+            )
+        )
+    kind = view[1]
+    numbers = _decode_varints(view[2:])
+    if kind == FORMATDELTAWORDS:
+        return kind, list(
+            zip(itertools.accumulate(numbers[::2]), numbers[1::2])
+        )
+    if kind == FORMATDELTALIST:
+        added = numbers[1 : numbers[0] + 1]
+        removed = numbers[numbers[0] + 1 :]
+        return kind, (
+            list(itertools.accumulate(added)),
+            list(itertools.accumulate(removed)),
+        )
+    raise ValueError(
+        "".join(("Segment delta kind ", str(kind), " is not supported"))
+    )
+
+
+def _bitmap_from_words(words, integersize):
+    """Return bitmap, a non-negative int, from list of integersize words.
+
+    words is the bitmap representation used before bitmaps became a single
+    int: element i bit b represents record number i * integersize + b, and
+    the top bit of a word may be represented by a negative int.
+
+    """
+    mask = (1 << integersize) - 1
+    bitmap = 0
+    for word in reversed(words):
+        bitmap = (bitmap << integersize) | (word & mask)
+    return bitmap
 
 
 class Segment:
-    """Create list or bitmap of record numbers in a segment."""
+    """Create list or bitmap of record numbers in a segment.
+
+    The list is a set of record numbers and the bitmap is a bytearray where
+    bit n % 8 of byte n // 8 represents record number n within the segment.
+    Runs of consecutive record numbers may be held as an array of
+    boundaries, start0, stop0, start1, stop1, and so forth, where each run
+    is range(start, stop).
+
+    A record number is added to, or removed from, a bitmap by changing one
+    byte.  The bitmap is converted to an int for operations on the whole
+    bitmap, such as set algebra and conversion to another representation.
+
+    The representation is chosen by size, counted in integers: one per
+    record number for a set, MAPSIZE for a bitmap, and two per run.  The
+    choice is made when a set becomes too big for MAPSIZE, when runs are
+    added or removed, and after set algebra and other bulk operations.
+
+    The number of record numbers is maintained as the segment is changed so
+    len(<segment>), and the decisions to convert between set and bitmap,
+    do not count the record numbers.
+
+    The segment geometry is given by the MAPSIZE, INTEGERSIZE, and
+    SEGMENTSIZE, class attributes.  Use segment_class() to get a Segment
+    class for another geometry.
+
+    Changes are tracked from the last call of mark_saved(), or from
+    creation if the segment was decoded from a stored value, so delta()
+    can give just the changes for writing to storage.
+
+    """
+
+    MAPSIZE = MAPSIZE
+    INTEGERSIZE = INTEGERSIZE
+    SEGMENTSIZE = SEGMENTSIZE
+    SEGMENTSHIFT = None  # log2(SEGMENTSIZE) if SEGMENTSIZE is a power of 2
 
     def __init__(self, segment, pickled=None, bitmap=False, values=None):
         """Create a set of record numbers.
 
-        Convert to bitmap if len(set) greater than len(list) for bitmap.
+        Convert to bitmap or runs if smaller than the set.
         If pickled Segment instance passed use it to create self.values.
         If values passed then bitmap determines how self.values is created.
         Default is an empty set.
         The segment number must be specified.
 
+        A bitmap passed in values may be an int or a list of MAPSIZE
+        INTEGERSIZE bit integers.  A value produced by pickle_map() may be
+        passed in pickled.
+
         """
         self.segment = segment
+        self._rank_table = self._sorted = None
+        self._changed = None
         if pickled is not None:
-            self.values = pickle.loads(pickled)
+            values = pickle.loads(pickled)
+            if isinstance(values, list):  # Bitmap as a list of words.
+                values = _bitmap_from_words(values, self.INTEGERSIZE)
+            self._set_values(values)
+            self.mark_saved()
         elif bitmap:
             if values is None:
-                self.values = [0] * MAPSIZE
+                self._set_values(0)
+            elif isinstance(values, int):
+                self._set_values(values)
             else:
-                self.values = list(values)
+                self._set_values(_bitmap_from_words(values, self.INTEGERSIZE))
         else:
             if values is None:
-                self.values = set()
+                self._set_values(set())
             else:
-                self.values = set(values)
-                if len(self.values) > MAPSIZE:
-                    self.convert_to_bitmap()
+                self._set_values(set(values))
+                self._normalise()
+
+    @classmethod
+    def locate(cls, number):
+        """Return (segment number, position in segment) for record number.
+
+        A shift and mask are used if SEGMENTSIZE is a power of 2, otherwise
+        divmod.
+
+        """
+        if cls.SEGMENTSHIFT is None:
+            return divmod(number, cls.SEGMENTSIZE)
+        return number >> cls.SEGMENTSHIFT, number & cls.SEGMENTSIZE - 1
+
+    def __len__(self):
+        """Return number of record numbers in segment."""
+        return self._count
+
+    def __contains__(self, number):
+        """Return True if record number is in segment."""
+        segment, number = self.locate(number)
+        if segment != self.segment:
+            return False
+        values = self.values
+        if isinstance(values, set):
+            return number in values
+        if isinstance(values, bytearray):
+            return bool(values[number >> 3] >> (number & 7) & 1)
+        return bool(bisect.bisect_right(values, number) & 1)
+
+    def copy(self):
+        """Return a new Segment with the same record numbers as self."""
+        segment = self.__class__(self.segment)
+        values = self.values
+        if isinstance(values, set):
+            segment.values = set(values)
+        elif isinstance(values, bytearray):
+            segment.values = bytearray(values)
+        else:
+            segment.values = array(RUNSTYPECODE, values)
+        segment._count = self._count
+        if self._changed is not None:
+            segment._changed = bytearray(self._changed)
+        return segment
 
     def add_record_number(self, number):
         """Add record number."""
-        segment, number = divmod(number, SEGMENTSIZE)
+        segment, number = self.locate(number)
         if segment != self.segment:
             return
         if isinstance(self.values, set):
-            self.values.add(number)
-            if len(self.values) > MAPSIZE:
-                self.convert_to_bitmap()
+            if number not in self.values:
+                self.values.add(number)
+                self._count += 1
+                self._rank_table = self._sorted = None
+                self._note_change(number)
+                if self._count > self.MAPSIZE:
+                    self._normalise()
+        elif isinstance(self.values, bytearray):
+            bit = 1 << (number & 7)
+            if not self.values[number >> 3] & bit:
+                self.values[number >> 3] |= bit
+                self._count += 1
+                self._rank_table = self._sorted = None
+                self._note_change(number)
+        else:
+            self._add_to_runs(number)
+
+    def add_many(self, numbers):
+        """Add record numbers in numbers which are in this segment.
+
+        numbers - an iterable of record numbers.  A range, or an array
+        which must be in ascending order, is cut down to this segment by
+        bisection rather than by testing each element.
+
+        The record numbers are gathered into one bitmap and applied as a
+        single int operation, unless they fit in the segment's set, or are
+        few enough to be set a byte at a time in the segment's bitmap, and
+        the representation is chosen once at the end.  A bitmap is left as
+        a bitmap when it's bytes are set directly, as by add_record_number.
+
+        """
+        offsets = self._segment_offsets(numbers)
+        if not offsets:
+            return
+        values = self.values
+        if isinstance(values, bytearray) and self._is_small_batch(offsets):
+            self._change_bits(offsets, True)
+            return
+        before = self._tracked_bitmap()
+        if (
+            isinstance(values, set)
+            and len(values) + len(offsets) <= self.MAPSIZE
+        ):
+            values.update(offsets)
+            self._count = len(values)
+            self._rank_table = self._sorted = None
         else:
-            element, bit = divmod(number, INTEGERSIZE)
-            self.values[element] |= BITMASK[bit]
+            self._set_values(
+                _as_bitmap(values, self.SEGMENTSIZE)
+                | _bitmap_from_positions(offsets, self.SEGMENTSIZE)
+            )
+        self._normalise()
+        self._note_changes(before)
+
+    def remove_many(self, numbers):
+        """Remove record numbers in numbers which are in this segment.
+
+        numbers - an iterable of record numbers, treated as in add_many.
+
+        Record numbers not in the segment are ignored.  A bitmap is changed
+        a byte at a time for a small batch, as in add_many, and then the
+        representation is chosen only if it has fewer than MAPSIZE record
+        numbers, as by remove_record_number with convert True.
+
+        """
+        offsets = self._segment_offsets(numbers)
+        if not offsets:
+            return
+        values = self.values
+        if isinstance(values, bytearray) and self._is_small_batch(offsets):
+            self._change_bits(offsets, False)
+            if self._count < self.MAPSIZE:
+                self._normalise()
+            return
+        before = self._tracked_bitmap()
+        if isinstance(values, set):
+            values.difference_update(offsets)
+            self._count = len(values)
+            self._rank_table = self._sorted = None
+        else:
+            self._set_values(
+                _as_bitmap(values, self.SEGMENTSIZE)
+                & ~_bitmap_from_positions(offsets, self.SEGMENTSIZE)
+            )
+        self._normalise()
+        self._note_changes(before)
+
+    def _is_small_batch(self, offsets):
+        """Return True if offsets are few enough to change bitmap bytes.
+
+        Changing the bytes costs time for each record number, while the int
+        operations cost time for each bit in the bitmap, so the limit is a
+        fraction of SEGMENTSIZE.
+
+        """
+        return len(offsets) <= self.SEGMENTSIZE // SMALLBATCHDIVISOR
+
+    def _change_bits(self, offsets, present):
+        """Set, or clear, the bits at offsets in the bitmap representation.
+
+        present - True to set the bits and False to clear them.
+
+        """
+        values = self.values
+        count = self._count
+        changed = self._changed
+        if changed is not None and not changed:
+            changed.extend(bytes(self.SEGMENTSIZE // 8))
+        for position in offsets:
+            index = position >> 3
+            bit = 1 << (position & 7)
+            byte = values[index]
+            if bool(byte & bit) is not present:
+                values[index] = byte ^ bit
+                count += 1 if present else -1
+                if changed is not None:
+                    changed[index] ^= bit
+        if count != self._count:
+            self._count = count
+            self._rank_table = self._sorted = None
+
+    def _segment_offsets(self, numbers):
+        """Return positions in segment of record numbers in this segment.
+
+        A range is returned for a range argument, otherwise a list.
+
+        """
+        base = self.segment * self.SEGMENTSIZE
+        limit = base + self.SEGMENTSIZE
+        if isinstance(numbers, range):
+            if numbers.step < 0:
+                numbers = numbers[::-1]
+            low = bisect.bisect_left(numbers, base)
+            high = bisect.bisect_left(numbers, limit)
+            numbers = numbers[low:high]
+            return range(
+                numbers.start - base, numbers.stop - base, numbers.step
+            )
+        if isinstance(numbers, array):
+            low = bisect.bisect_left(numbers, base)
+            high = bisect.bisect_left(numbers, limit)
+            return [number - base for number in numbers[low:high]]
+        return [number - base for number in numbers if base <= number < limit]
 
     def convert_to_bitmap(self):
         """Convert segment to bitmap representation."""
+        if not isinstance(self.values, bytearray):
+            self.values = _bitmap_buffer(
+                _as_bitmap(self.values, self.SEGMENTSIZE), self.SEGMENTSIZE
+            )
+
+    def convert_to_runs(self):
+        """Convert segment to runs representation."""
         if isinstance(self.values, set):
-            values = self.values
-            self.values = [0] * MAPSIZE
-            for i in values:
-                element, bit = divmod(i, INTEGERSIZE)
-                self.values[element] |= BITMASK[bit]
+            self.values = _runs_array(_runs_from_numbers(sorted(self.values)))
+        elif isinstance(self.values, bytearray):
+            self.values = _runs_array(
+                _runs_from_bitmap(_as_bitmap(self.values, self.SEGMENTSIZE))
+            )
 
     def convert_to_set(self):
         """Convert segment to set representation."""
-        if not isinstance(self.values, set):
-            values = self.values
-            self.values = set()
-            for i in SEGMENTRANGE:
-                element, bit = divmod(i, INTEGERSIZE)
-                if values[element] & BITMASK[bit]:
-                    self.values.add(i)
+        if isinstance(self.values, bytearray):
+            self.values = set(_buffer_positions(self.values))
+        elif isinstance(self.values, array):
+            self.values = set(
+                itertools.chain.from_iterable(
+                    itertools.starmap(range, _run_pairs(self.values))
+                )
+            )
 
     def get_record_numbers(self):
         """Return sorted record number list for deferred update."""
         values = self.values
-        segment = self.segment
+        base = self.segment * self.SEGMENTSIZE
         if isinstance(values, set):
-            records = sorted([segment + j for j in values])
+            return sorted([base + j for j in values])
+        if isinstance(values, array):
+            return list(
+                itertools.chain.from_iterable(
+                    range(base + start, base + stop)
+                    for start, stop in _run_pairs(values)
+                )
+            )
+        if not base:
+            return _buffer_positions(values)
+        return [base + j for j in _buffer_positions(values)]
+
+    def iter_record_numbers(self, start=None, reverse=False):
+        """Return iterator of record numbers in ascending or descending order.
+
+        start - first record number yielded if in segment, default the
+        first, or last if reverse is True, record number in segment.
+        reverse - if True yield record numbers in descending order.
+
+        Record numbers are found as the iterator advances: a bitmap is read
+        a word at a time from start and runs are found by bisection, so the
+        cost is proportional to the words or runs passed.  A set, at most
+        MAPSIZE record numbers, is sorted when first needed after a change.
+        The segment must not be changed while the iterator is in use.
+
+        """
+        base = self.segment * self.SEGMENTSIZE
+        if start is None:
+            position = self.SEGMENTSIZE - 1 if reverse else 0
+        elif reverse:
+            position = min(start - base, self.SEGMENTSIZE - 1)
+        else:
+            position = max(start - base, 0)
+        if not 0 <= position < self.SEGMENTSIZE:
+            return iter(())
+        return map(base.__add__, self._iter_offsets(position, reverse))
+
+    def _iter_offsets(self, position, reverse):
+        """Yield positions of record numbers from position in segment."""
+        values = self.values
+        if isinstance(values, set):
+            numbers = self._sorted_positions()
+            if reverse:
+                index = bisect.bisect_right(numbers, position)
+                yield from reversed(numbers[:index])
+            else:
+                index = bisect.bisect_left(numbers, position)
+                yield from itertools.islice(numbers, index, None)
+        elif isinstance(values, bytearray):
+            size = self.INTEGERSIZE // 8
+            first = position // self.INTEGERSIZE * size
+            bit = position % self.INTEGERSIZE
+            if reverse:
+                mask = (2 << bit) - 1
+                for start in range(first, -1, -size):
+                    word = mask & int.from_bytes(
+                        values[start : start + size], "little"
+                    )
+                    mask = -1
+                    while word:
+                        bit = word.bit_length() - 1
+                        yield start * 8 + bit
+                        word ^= 1 << bit
+            else:
+                mask = -1 << bit
+                for start in range(first, len(values), size):
+                    word = mask & int.from_bytes(
+                        values[start : start + size], "little"
+                    )
+                    mask = -1
+                    while word:
+                        low = word & -word
+                        yield start * 8 + low.bit_length() - 1
+                        word ^= low
+        elif reverse:
+            index = bisect.bisect_right(values, position)
+            if index & 1:
+                yield from range(position, values[index - 1] - 1, -1)
+                index -= 1
+            for index in range(index - 2, -1, -2):
+                yield from range(values[index + 1] - 1, values[index] - 1, -1)
         else:
-            records = []
-            for i in SEGMENTRANGE:
-                element, bit = divmod(i, INTEGERSIZE)
-                if self.values[element] & BITMASK[bit]:
-                    records.append(segment + i)
-        return records
+            index = bisect.bisect_right(values, position)
+            if index & 1:
+                yield from range(position, values[index])
+                index += 1
+            for index in range(index, len(values), 2):
+                yield from range(values[index], values[index + 1])
+
+    def first(self):
+        """Return lowest record number in segment or None if empty."""
+        return self._seek(0, False)
+
+    def last(self):
+        """Return highest record number in segment or None if empty."""
+        return self._seek(self.SEGMENTSIZE - 1, True)
+
+    def next_after(self, number):
+        """Return lowest record number above number or None if none."""
+        position = number + 1 - self.segment * self.SEGMENTSIZE
+        if position >= self.SEGMENTSIZE:
+            return None
+        return self._seek(max(position, 0), False)
+
+    def prev_before(self, number):
+        """Return highest record number below number or None if none."""
+        position = number - 1 - self.segment * self.SEGMENTSIZE
+        if position < 0:
+            return None
+        return self._seek(min(position, self.SEGMENTSIZE - 1), True)
+
+    def _seek(self, position, reverse):
+        """Return nearest record number at or beyond position, or None.
+
+        position - position in segment to start search.
+        reverse - if True search downwards, otherwise upwards.
+
+        A bitmap is searched by int operations on the whole bitmap, and
+        runs, or the sorted members of a set, by bisection.
+
+        """
+        values = self.values
+        if isinstance(values, set):
+            numbers = self._sorted_positions()
+            if reverse:
+                index = bisect.bisect_right(numbers, position)
+                found = numbers[index - 1] if index else None
+            else:
+                index = bisect.bisect_left(numbers, position)
+                found = numbers[index] if index < len(numbers) else None
+        elif isinstance(values, bytearray):
+            values = _as_bitmap(values, self.SEGMENTSIZE)
+            if reverse:
+                values &= (2 << position) - 1
+                if not values:
+                    return None
+                found = values.bit_length() - 1
+            else:
+                values >>= position
+                if not values:
+                    return None
+                found = position + (values & -values).bit_length() - 1
+        else:
+            index = bisect.bisect_right(values, position)
+            if index & 1:
+                found = position
+            elif reverse:
+                found = values[index - 1] - 1 if index else None
+            else:
+                found = values[index] if index < len(values) else None
+        if found is None:
+            return None
+        return self.segment * self.SEGMENTSIZE + found
+
+    def _sorted_positions(self):
+        """Return sorted list of positions in set representation of segment.
+
+        The list is built when first needed after a change to the record
+        numbers in the segment.
+
+        """
+        if self._sorted is None:
+            self._sorted = sorted(self.values)
+        return self._sorted
+
+    def rank(self, number):
+        """Return number of record numbers in segment less than number.
+
+        This is the position of number in get_record_numbers() if number
+        is in the segment.
+
+        """
+        position = number - self.segment * self.SEGMENTSIZE
+        if position <= 0:
+            return 0
+        if position >= self.SEGMENTSIZE:
+            return self._count
+        words, counts = self._get_rank_table()
+        word, bit = divmod(position, self.INTEGERSIZE)
+        return counts[word] + _popcount(words[word] & ((1 << bit) - 1))
+
+    def select(self, index):
+        """Return record number at index in get_record_numbers().
+
+        index - position of record number, negative counts from the end.
+
+        IndexError is raised if index is out of range.
+
+        """
+        if index < 0:
+            index += self._count
+        if not 0 <= index < self._count:
+            raise IndexError("Segment index out of range")
+        words, counts = self._get_rank_table()
+        word = bisect.bisect_right(counts, index) - 1
+        value = words[word]
+        for _ in range(index - counts[word]):
+            value &= value - 1
+        return (
+            self.segment * self.SEGMENTSIZE
+            + word * self.INTEGERSIZE
+            + (value & -value).bit_length()
+            - 1
+        )
+
+    def _get_rank_table(self):
+        """Return words of bitmap and count of record numbers before each.
+
+        The table is built from the current representation when first
+        needed after a change to the record numbers in the segment.  NumPy
+        is used to split the bitmap into words only if it has an unsigned
+        integer type of INTEGERSIZE bits.
+
+        """
+        if self._rank_table is None:
+            data = self.values
+            if not isinstance(data, bytearray):
+                data = _as_bitmap(data, self.SEGMENTSIZE).to_bytes(
+                    self.SEGMENTSIZE // 8, "little"
+                )
+            data = memoryview(data)
+            size = self.INTEGERSIZE // 8
+            numpy = _get_numpy()
+            if numpy is not None and size in (1, 2, 4, 8):
+                words = numpy.frombuffer(
+                    data, dtype=numpy.dtype("<u" + str(size))
+                ).tolist()
+            else:
+                words = [
+                    int.from_bytes(data[start : start + size], "little")
+                    for start in range(0, len(data), size)
+                ]
+            counts = list(
+                itertools.accumulate(map(_popcount, words), initial=0)
+            )
+            self._rank_table = words, counts
+        return self._rank_table
 
     def pickle_map(self):
-        """Return record number set for use in dbm style value."""
-        return pickle.dumps(self.values, pickle.HIGHEST_PROTOCOL)
+        """Return record number set for use in dbm style value.
+
+        The value is pickled in the form used before bitmaps were held as a
+        bytearray: a set of record numbers, or, if there are more than
+        MAPSIZE record numbers or the segment is a bitmap, a list of MAPSIZE
+        INTEGERSIZE bit integers where the top bit is the sign bit.  Runs
+        are pickled as one of these.  Use to_bytes() for a compact value.
+
+        """
+        values = self.values
+        if isinstance(values, array) and self._count <= self.MAPSIZE:
+            values = set(
+                itertools.chain.from_iterable(
+                    itertools.starmap(range, _run_pairs(values))
+                )
+            )
+        if not isinstance(values, set):
+            sign = 1 << self.INTEGERSIZE - 1
+            values = [
+                word - (word & sign) * 2 for word in self._get_rank_table()[0]
+            ]
+        return pickle.dumps(values, pickle.HIGHEST_PROTOCOL)
 
     def remove_record_number(self, number, convert=False):
         """Remove record number."""
-        segment, number = divmod(number, SEGMENTSIZE)
+        segment, number = self.locate(number)
         if segment != self.segment:
             return
         if isinstance(self.values, set):
             self.values.remove(number)
+            self._count -= 1
+            self._rank_table = self._sorted = None
+            self._note_change(number)
+        elif isinstance(self.values, bytearray):
+            bit = 1 << (number & 7)
+            if self.values[number >> 3] & bit:
+                self.values[number >> 3] ^= bit
+                self._count -= 1
+                self._rank_table = self._sorted = None
+                self._note_change(number)
+            if convert and self._count < self.MAPSIZE:
+                self._normalise()
+        else:
+            self._remove_from_runs(number)
+
+    def _add_to_runs(self, number):
+        """Add number to runs representation and adjust representation."""
+        boundaries = self.values
+        index = bisect.bisect_right(boundaries, number)
+        if index & 1:
+            return
+        if index and boundaries[index - 1] == number:
+            if index < len(boundaries) and boundaries[index] == number + 1:
+                del boundaries[index - 1 : index + 1]
+            else:
+                boundaries[index - 1] = number + 1
+        elif index < len(boundaries) and boundaries[index] == number + 1:
+            boundaries[index] = number
+        else:
+            boundaries[index:index] = array(RUNSTYPECODE, (number, number + 1))
+        self._count += 1
+        self._rank_table = self._sorted = None
+        self._note_change(number)
+        self._normalise_runs()
+
+    def _remove_from_runs(self, number):
+        """Remove number from runs representation and adjust representation."""
+        boundaries = self.values
+        index = bisect.bisect_right(boundaries, number)
+        if not index & 1:
+            return
+        start = boundaries[index - 1]
+        stop = boundaries[index]
+        if start == number:
+            if stop == number + 1:
+                del boundaries[index - 1 : index + 1]
+            else:
+                boundaries[index - 1] = number + 1
+        elif stop == number + 1:
+            boundaries[index] = number
+        else:
+            boundaries[index:index] = array(RUNSTYPECODE, (number, number + 1))
+        self._count -= 1
+        self._rank_table = self._sorted = None
+        self._note_change(number)
+        self._normalise_runs()
+
+    def _normalise_runs(self):
+        """Convert runs to set or bitmap if runs are no longer smallest."""
+        if len(self.values) >= min(self._count, self.MAPSIZE):
+            if self._count > self.MAPSIZE:
+                self.convert_to_bitmap()
+            else:
+                self.convert_to_set()
+
+    def to_bytes(self):
+        """Return record number set in versioned format for dbm style value.
+
+        The encoding is the one for the representation _normalise() would
+        choose: FORMATFIXEDRUNS for runs, FORMATFIXEDLIST for a set, and
+        FORMATBITMAP for a bitmap.  The value produced can be given to
+        from_bytes().
+
+        """
+        values = self.values
+        count = self._count
+        numbers = None
+        if isinstance(values, set):
+            numbers = sorted(values)
+            runs = _runs_from_numbers(numbers)
+        elif isinstance(values, bytearray):
+            runs = _runs_from_bitmap(_as_bitmap(values, self.SEGMENTSIZE))
+        else:
+            runs = list(_run_pairs(values))
+        if 2 * len(runs) < min(count, self.MAPSIZE):
+            kind = FORMATFIXEDRUNS
+            body = _encode_fixed_width(
+                itertools.chain.from_iterable(runs), self.SEGMENTSIZE
+            )
+        elif count <= self.MAPSIZE:
+            kind = FORMATFIXEDLIST
+            if numbers is None:
+                numbers = itertools.chain.from_iterable(
+                    itertools.starmap(range, runs)
+                )
+            body = _encode_fixed_width(numbers, self.SEGMENTSIZE)
+        else:
+            kind = FORMATBITMAP
+            bitmap = _as_bitmap(values, self.SEGMENTSIZE)
+            body = bitmap.to_bytes((bitmap.bit_length() + 7) // 8, "little")
+        return b"".join((bytes((FORMATVERSION, kind)), body))
+
+    @classmethod
+    def from_bytes(cls, segment, data):
+        """Return Segment for segment number from data.
+
+        segment - the segment number.
+        data - a bytes-like object produced by to_bytes() or pickle_map().
+
+        data is read through a memoryview so it is not copied before being
+        decoded.  The fixed-width encodings are decoded by array methods
+        and give the representation directly, without _normalise().
+
+        """
+        view = memoryview(data)
+        if view[0] == pickle.PROTO[0]:
+            return cls(segment, pickled=view)
+        if view[0] != FORMATVERSION:
+            raise ValueError(
+                "".join(
+                    (
+                        "Segment format version ",
+                        str(view[0]),
+                        " is not supported",
+                    )
+                )
+            )
+        kind = view[1]
+        body = view[2:]
+        if kind == FORMATBITMAP:
+            return cls.from_bitmap(segment, body)
+        instance = cls(segment)
+        if kind == FORMATFIXEDLIST:
+            instance._set_values(
+                set(_decode_fixed_width(body, cls.SEGMENTSIZE))
+            )
+        elif kind == FORMATFIXEDRUNS:
+            instance._set_values(
+                array(RUNSTYPECODE, _decode_fixed_width(body, cls.SEGMENTSIZE))
+            )
+        else:
+            raise ValueError(
+                "".join(
+                    ("Segment format kind ", str(kind), " is not supported")
+                )
+            )
+        instance.mark_saved()
+        return instance
+
+    def bitmap_bytes(self):
+        """Return record numbers as little-endian bitmap of SEGMENTSIZE bits.
+
+        Bit n of the bitmap represents record number n within the segment
+        whatever the representation of the segment.
+
+        """
+        return _as_bitmap(self.values, self.SEGMENTSIZE).to_bytes(
+            self.SEGMENTSIZE // 8, "little"
+        )
+
+    @classmethod
+    def from_bitmap(cls, segment, data):
+        """Return Segment for segment number from little-endian bitmap.
+
+        segment - the segment number.
+        data - a bytes-like object, such as a memoryview of a page in a
+        memory-mapped file, in the format produced by bitmap_bytes().
+
+        """
+        instance = cls(segment)
+        values = bytearray(cls.SEGMENTSIZE // 8)
+        values[: len(data)] = data
+        instance._set_values(values)
+        instance._normalise()
+        instance.mark_saved()
+        return instance
+
+    def mark_saved(self):
+        """Note the segment is saved and track changes from now.
+
+        Changes are noted in a bitmap, a bytearray like the bitmap
+        representation, where a set bit is a changed record number.  The
+        bytearray is empty until the first change so an unchanged segment,
+        perhaps just decoded, does not carry a full bitmap of changes.
+
+        """
+        self._changed = bytearray()
+
+    def dirty_words(self):
+        """Return sorted list of indices of words changed since last save.
+
+        Word i of the bitmap holds bits i * INTEGERSIZE upwards.  None is
+        returned if changes are not being tracked.
+
+        """
+        changed = self._changed
+        if changed is None:
+            return None
+        size = self.INTEGERSIZE // 8
+        unchanged = bytes(size)
+        return [
+            index
+            for index, start in enumerate(range(0, len(changed), size))
+            if changed[start : start + size] != unchanged
+        ]
+
+    def delta(self):
+        """Return changes since last save for apply_delta() of saved value.
+
+        The changed words of the bitmap, as (word index, word) pairs, are
+        given unless the lists of added and removed record numbers are
+        smaller.
+
+        ValueError is raised if changes are not being tracked.
+
+        """
+        words = self.dirty_words()
+        if words is None:
+            raise ValueError(
+                "Segment changes are not tracked until mark_saved() is called"
+            )
+        size = self.INTEGERSIZE
+        mask = (1 << size) - 1
+        bitmap = _as_bitmap(self.values, self.SEGMENTSIZE)
+        body = _encode_varints(
+            itertools.chain.from_iterable(
+                (index - previous, bitmap >> index * size & mask)
+                for index, previous in zip(words, itertools.chain((0,), words))
+            )
+        )
+        kind = FORMATDELTAWORDS
+        changed = int.from_bytes(self._changed, "little")
+        if _popcount(changed) < len(body):
+            added = _bitmap_positions(changed & bitmap)
+            removed = _bitmap_positions(changed & ~bitmap)
+            numbers = _encode_varints((len(added),))
+            numbers += _encode_ascending(added)
+            numbers += _encode_ascending(removed)
+            if len(numbers) < len(body):
+                kind = FORMATDELTALIST
+                body = numbers
+        return b"".join((bytes((FORMATVERSION, kind)), body))
+
+    def apply_delta(self, data):
+        """Apply changes in data, produced by delta(), to self.
+
+        self should have the record numbers saved when the changes began,
+        and then has the record numbers of the segment delta() was given.
+
+        """
+        kind, changes = decode_delta(data)
+        if kind == FORMATDELTALIST:
+            base = self.segment * self.SEGMENTSIZE
+            added, removed = changes
+            self.add_many([base + number for number in added])
+            self.remove_many([base + number for number in removed])
+            return
+        size = self.INTEGERSIZE
+        mask = (1 << size) - 1
+        clear = 0
+        words = 0
+        for index, word in changes:
+            clear |= mask << index * size
+            words |= word << index * size
+        before = self._tracked_bitmap()
+        self._set_values(
+            _as_bitmap(self.values, self.SEGMENTSIZE) & ~clear | words
+        )
+        self._normalise()
+        self._note_changes(before)
+
+    def __and__(self, other):
+        """Return Segment of record numbers in both self and other."""
+        return self._new_segment(self._combine(other, operator.and_))
+
+    def __or__(self, other):
+        """Return Segment of record numbers in either self or other."""
+        return self._new_segment(self._combine(other, operator.or_))
+
+    def __xor__(self, other):
+        """Return Segment of record numbers in exactly one of self or other."""
+        return self._new_segment(self._combine(other, operator.xor))
+
+    def __sub__(self, other):
+        """Return Segment of record numbers in self but not in other."""
+        return self._new_segment(self._combine(other, operator.sub))
+
+    def __iand__(self, other):
+        """Keep record numbers which are also in other and return self."""
+        self._replace_values(self._combine(other, operator.and_))
+        return self
+
+    def __ior__(self, other):
+        """Add record numbers in other and return self."""
+        self._replace_values(self._combine(other, operator.or_))
+        return self
+
+    def __ixor__(self, other):
+        """Toggle record numbers in other and return self."""
+        self._replace_values(self._combine(other, operator.xor))
+        return self
+
+    def __isub__(self, other):
+        """Remove record numbers in other and return self."""
+        self._replace_values(self._combine(other, operator.sub))
+        return self
+
+    def _combine(self, other, function):
+        """Return values for function applied to self and other values.
+
+        function - one of operator.and_, or_, xor, or sub.
+
+        Neither self.values nor other.values is modified.  Bitmaps are
+        combined as ints by int operators.  A set is combined
+        with a bitmap by probing the bitmap for each member of the set
+        where the answer must be a subset of the set, otherwise the set
+        is converted to a bitmap and combined with the bitmap.  Runs are
+        converted to a bitmap before being combined.
+
+        """
+        if not isinstance(other, Segment):
+            raise TypeError("Segment can be combined only with a Segment")
+        if other.SEGMENTSIZE != self.SEGMENTSIZE:
+            raise ValueError(
+                "".join(
+                    (
+                        "Segment of size ",
+                        str(self.SEGMENTSIZE),
+                        " cannot be combined with segment of size ",
+                        str(other.SEGMENTSIZE),
+                    )
+                )
+            )
+        if other.segment != self.segment:
+            raise ValueError(
+                "".join(
+                    (
+                        "Segment ",
+                        str(self.segment),
+                        " cannot be combined with segment ",
+                        str(other.segment),
+                    )
+                )
+            )
+        left = self.values
+        right = other.values
+        if not isinstance(left, set):
+            left = _as_bitmap(left, self.SEGMENTSIZE)
+        if not isinstance(right, set):
+            right = _as_bitmap(right, self.SEGMENTSIZE)
+        if isinstance(left, set):
+            if isinstance(right, set):
+                return function(left, right)
+            if function is operator.and_:
+                return _probe_bitmap(left, right, True)
+            if function is operator.sub:
+                return _probe_bitmap(left, right, False)
+            left = _bitmap_from_positions(left, self.SEGMENTSIZE)
+        elif isinstance(right, set):
+            if function is operator.and_:
+                return _probe_bitmap(right, left, True)
+            right = _bitmap_from_positions(right, self.SEGMENTSIZE)
+        if function is operator.sub:
+            return left & ~right
+        return function(left, right)
+
+    def _replace_values(self, values):
+        """Set self.values to values, normalised, noting changes."""
+        before = self._tracked_bitmap()
+        self._set_values(values)
+        self._normalise()
+        self._note_changes(before)
+
+    def _note_change(self, position):
+        """Note change at position if changes are being tracked."""
+        changed = self._changed
+        if changed is not None:
+            if not changed:
+                changed.extend(bytes(self.SEGMENTSIZE // 8))
+            changed[position >> 3] ^= 1 << (position & 7)
+
+    def _tracked_bitmap(self):
+        """Return values as bitmap if changes are being tracked or None."""
+        if self._changed is None:
+            return None
+        return _as_bitmap(self.values, self.SEGMENTSIZE)
+
+    def _note_changes(self, before):
+        """Note changes since before, from _tracked_bitmap(), were taken."""
+        if before is not None:
+            changed = (
+                _as_bitmap(self._changed, self.SEGMENTSIZE)
+                ^ before
+                ^ _as_bitmap(self.values, self.SEGMENTSIZE)
+            )
+            if changed:
+                self._changed = _bitmap_buffer(changed, self.SEGMENTSIZE)
+            else:
+                self._changed = bytearray()
+
+    def _new_segment(self, values):
+        """Return a new Segment for self.segment containing values."""
+        segment = self.__class__(self.segment)
+        segment._set_values(values)
+        segment._normalise()
+        return segment
+
+    def _normalise(self):
+        """Convert to set, bitmap, or runs, representation by size.
+
+        A set is converted to a bitmap if it has more than MAPSIZE record
+        numbers and a bitmap is converted to a set if it has fewer, so a
+        segment with MAPSIZE record numbers keeps it's representation.
+
+        """
+        values = self.values
+        count = self._count
+        if isinstance(values, set):
+            runs = sum(1 for n in values if n - 1 not in values)
+        elif isinstance(values, bytearray):
+            bitmap = _as_bitmap(values, self.SEGMENTSIZE)
+            runs = _popcount(bitmap & ~(bitmap << 1))
+        else:
+            runs = len(values) // 2
+        if 2 * runs < min(count, self.MAPSIZE):
+            self.convert_to_runs()
+        elif isinstance(values, set):
+            if count > self.MAPSIZE:
+                self.convert_to_bitmap()
+        elif isinstance(values, bytearray):
+            if count < self.MAPSIZE:
+                self.convert_to_set()
+        elif count > self.MAPSIZE:
+            self.convert_to_bitmap()
         else:
-            element, bit = divmod(number, INTEGERSIZE)
-            self.values[element] &= ~BITMASK[bit]
-            if convert:
-                count = 0
-                values = self.values
-                for i in SEGMENTRANGE:
-                    element, bit = divmod(i, INTEGERSIZE)
-                    if values[element] & BITMASK[bit]:
-                        count += 1
-                if count < MAPSIZE:
-                    self.convert_to_set()
+            self.convert_to_set()
+
+    def _set_values(self, values):
+        """Set self.values to values and count the record numbers.
+
+        values - a set of record numbers, a bitmap int or bytearray, or an
+        array of run boundaries.  A bitmap int is held as a bytearray.
+
+        This is the one place where counting is done: all other changes to
+        the segment adjust the count.
+
+        """
+        if isinstance(values, int):
+            values = _bitmap_buffer(values, self.SEGMENTSIZE)
+        self.values = values
+        if isinstance(values, set):
+            self._count = len(values)
+            self._rank_table = self._sorted = None
+        elif isinstance(values, bytearray):
+            self._count = _popcount(int.from_bytes(values, "little"))
+            self._rank_table = self._sorted = None
+        else:
+            self._count = sum(values[1::2]) - sum(values[::2])
+            self._rank_table = self._sorted = None
 
     def encode_segment_number(self):
         """Return segment number for use in dbm style key."""
         return "".join((SEGMENTDELIMITER, str(self.segment)))
+
+
+_segment_classes = {(MAPSIZE, INTEGERSIZE): Segment}
+
+
+def segment_class(mapsize=MAPSIZE, integersize=INTEGERSIZE):
+    """Return Segment class for segments of mapsize integersize bit integers.
+
+    mapsize - number of integers in a segment bitmap, also the number of
+    record numbers above which a set is converted to a bitmap.
+    integersize - bits per integer, a multiple of 8, such as 32 or 64.
+
+    The same class is returned for repeated calls with the same geometry,
+    and Segment itself for the default geometry.  Record numbers are
+    located by shift and mask if mapsize * integersize is a power of 2.
+
+    """
+    key = (mapsize, integersize)
+    cls = _segment_classes.get(key)
+    if cls is not None:
+        return cls
+    if mapsize < 1 or integersize < 8 or integersize % 8:
+        raise ValueError(
+            "".join(
+                (
+                    "Segment geometry needs mapsize at least 1 and ",
+                    "integersize a positive multiple of 8",
+                )
+            )
+        )
+    segmentsize = mapsize * integersize
+    if segmentsize & (segmentsize - 1):
+        shift = None
+    else:
+        shift = segmentsize.bit_length() - 1
+    cls = type(
+        "".join(("Segment", str(mapsize), "x", str(integersize))),
+        (Segment,),
+        dict(
+            __doc__="".join(
+                (
+                    "Segment of ",
+                    str(mapsize),
+                    " ",
+                    str(integersize),
+                    " bit integers.",
+                )
+            ),
+            MAPSIZE=mapsize,
+            INTEGERSIZE=integersize,
+            SEGMENTSIZE=segmentsize,
+            SEGMENTSHIFT=shift,
+        ),
+    )
+    _segment_classes[key] = cls
+    return cls
+
+
+class ConcurrentSegment:
+    """Segment changed by writer threads and read without locks.
+
+    The record numbers are in a Segment which is never changed once it is
+    published by snapshot().  A writer changes a copy, under a lock shared
+    only with other writers, and publishes it by a single assignment, so a
+    reader sees either the old or the new record numbers and never a
+    segment part way through an update or change of representation.
+
+    A copy is at most the size of a bitmap, MAPSIZE integers, whatever the
+    representation.  Use update() to make many changes for one copy.
+
+    """
+
+    segment_class = Segment
+
+    def __init__(self, segment, values=None):
+        """Create concurrent segment for segment number with values.
+
+        values - positions in segment as for Segment(segment, values=...).
+
+        """
+        self._lock = threading.Lock()
+        self._segment = self.segment_class(segment, values=values)
+        self.version = 0
+
+    @property
+    def segment(self):
+        """Return the segment number."""
+        return self._segment.segment
+
+    def __len__(self):
+        """Return number of record numbers in latest published version."""
+        return len(self._segment)
+
+    def __contains__(self, number):
+        """Return True if record number is in latest published version."""
+        return number in self._segment
+
+    def snapshot(self):
+        """Return the latest published Segment.
+
+        The Segment is shared with other readers and must be treated as
+        read-only: use it's copy() method to get a Segment to change.
+
+        """
+        return self._segment
+
+    def get_record_numbers(self):
+        """Return sorted record number list of latest published version."""
+        return self._segment.get_record_numbers()
+
+    def update(self, function):
+        """Apply function to a copy of segment and publish the copy.
+
+        function - called with the copy as it's only argument.
+
+        Nothing is published if function raises an exception.  The
+        published Segment is returned.
+
+        """
+        with self._lock:
+            segment = self._segment.copy()
+            function(segment)
+            self._segment = segment
+            self.version += 1
+            return segment
+
+    def add_record_number(self, number):
+        """Publish segment with record number added."""
+        self.update(lambda segment: segment.add_record_number(number))
+
+    def remove_record_number(self, number):
+        """Publish segment with record number removed."""
+        self.update(lambda segment: segment.remove_record_number(number))
+
+    def add_many(self, numbers):
+        """Publish segment with record numbers in numbers added."""
+        self.update(lambda segment: segment.add_many(numbers))
+
+    def remove_many(self, numbers):
+        """Publish segment with record numbers in numbers removed."""
+        self.update(lambda segment: segment.remove_many(numbers))
+
+
+class RecordSet:
+    """Create a set of record numbers held as Segments by segment number.
+
+    Record numbers are routed to the Segment for segment_class.locate(number)
+    and segments with no record numbers are not kept.  Set algebra between
+    RecordSet instances is done a segment at a time by Segment set algebra.
+
+    """
+
+    segment_class = Segment  # segment_class() gives other geometries
+
+    def __init__(self, record_numbers=None):
+        """Create a set of record numbers.
+
+        record_numbers - iterable of record numbers, default empty set.
+
+        """
+        self.segments = {}
+        self._segment_numbers = []
+        if record_numbers is not None:
+            self.add_many(record_numbers)
+
+    def __len__(self):
+        """Return number of record numbers in record set."""
+        return sum(len(segment) for segment in self.segments.values())
+
+    def __contains__(self, number):
+        """Return True if record number is in record set."""
+        segment = self.segments.get(self.segment_class.locate(number)[0])
+        if segment is None:
+            return False
+        return number in segment
+
+    def __iter__(self):
+        """Return iterator of record numbers in ascending order.
+
+        A segment's record numbers are not decoded until the iterator
+        reaches the segment.
+
+        """
+        for segment_number in self._segment_numbers:
+            yield from self.segments[segment_number].iter_record_numbers()
+
+    def iter_record_numbers(self, start=None, reverse=False):
+        """Yield record numbers in ascending or descending order.
+
+        start - first record number yielded if in record set, default the
+        first, or last if reverse is True, record number in record set.
+        reverse - if True yield record numbers in descending order.
+
+        """
+        numbers = self._segment_numbers
+        if reverse:
+            if start is None:
+                index = len(numbers)
+            else:
+                index = bisect.bisect_right(
+                    numbers, self.segment_class.locate(start)[0]
+                )
+            for segment_number in reversed(numbers[:index]):
+                yield from self.segments[segment_number].iter_record_numbers(
+                    start=start, reverse=True
+                )
+        else:
+            if start is None:
+                index = 0
+            else:
+                index = bisect.bisect_left(
+                    numbers, self.segment_class.locate(start)[0]
+                )
+            for segment_number in numbers[index:]:
+                yield from self.segments[segment_number].iter_record_numbers(
+                    start=start
+                )
+
+    def add(self, number):
+        """Add record number."""
+        segment_number = self.segment_class.locate(number)[0]
+        segment = self.segments.get(segment_number)
+        if segment is None:
+            segment = self.segment_class(segment_number)
+            self._insert_segment(segment)
+        segment.add_record_number(number)
+
+    def remove(self, number):
+        """Remove record number, raise KeyError if not in record set."""
+        if number not in self:
+            raise KeyError(number)
+        segment_number = self.segment_class.locate(number)[0]
+        segment = self.segments[segment_number]
+        segment.remove_record_number(number, convert=True)
+        if not len(segment):
+            self._delete_segment(segment_number)
+
+    def discard(self, number):
+        """Remove record number if it is in record set."""
+        if number in self:
+            self.remove(number)
+
+    def add_many(self, numbers):
+        """Add record numbers in numbers.
+
+        numbers - an iterable of record numbers.  A range, or an array in
+        ascending order, is given to each segment it spans, otherwise the
+        record numbers are grouped by segment first.
+
+        """
+        for segment_number, group in self._group_by_segment(numbers):
+            segment = self.segments.get(segment_number)
+            if segment is None:
+                segment = self.segment_class(segment_number)
+                self._insert_segment(segment)
+            segment.add_many(group)
+            if not len(segment):
+                self._delete_segment(segment_number)
+
+    def remove_many(self, numbers):
+        """Remove record numbers in numbers, ignoring those not present.
+
+        numbers - an iterable of record numbers, treated as in add_many.
+
+        """
+        for segment_number, group in self._group_by_segment(numbers):
+            segment = self.segments.get(segment_number)
+            if segment is None:
+                continue
+            segment.remove_many(group)
+            if not len(segment):
+                self._delete_segment(segment_number)
+
+    def get_record_numbers(self):
+        """Return sorted record number list."""
+        return list(self)
+
+    def rank(self, number):
+        """Return number of record numbers in record set less than number."""
+        segment_number = self.segment_class.locate(number)[0]
+        numbers = self._segment_numbers
+        count = sum(
+            len(self.segments[n])
+            for n in numbers[: bisect.bisect_left(numbers, segment_number)]
+        )
+        segment = self.segments.get(segment_number)
+        if segment is not None:
+            count += segment.rank(number)
+        return count
+
+    def select(self, index):
+        """Return record number at index in get_record_numbers().
+
+        index - position of record number, negative counts from the end.
+
+        IndexError is raised if index is out of range.
+
+        """
+        if index < 0:
+            index += len(self)
+        if index >= 0:
+            for segment_number in self._segment_numbers:
+                segment = self.segments[segment_number]
+                if index < len(segment):
+                    return segment.select(index)
+                index -= len(segment)
+        raise IndexError("RecordSet index out of range")
+
+    def __and__(self, other):
+        """Return RecordSet of record numbers in both self and other."""
+        return self._combine(other, operator.and_)
+
+    def __or__(self, other):
+        """Return RecordSet of record numbers in either self or other."""
+        return self._combine(other, operator.or_)
+
+    def __xor__(self, other):
+        """Return RecordSet of record numbers in one of self or other."""
+        return self._combine(other, operator.xor)
+
+    def __sub__(self, other):
+        """Return RecordSet of record numbers in self but not in other."""
+        return self._combine(other, operator.sub)
+
+    def __iand__(self, other):
+        """Keep record numbers which are also in other and return self."""
+        return self._combine(other, operator.iand)
+
+    def __ior__(self, other):
+        """Add record numbers in other and return self."""
+        return self._combine(other, operator.ior)
+
+    def __ixor__(self, other):
+        """Toggle record numbers in other and return self."""
+        return self._combine(other, operator.ixor)
+
+    def __isub__(self, other):
+        """Remove record numbers in other and return self."""
+        return self._combine(other, operator.isub)
+
+    def _combine(self, other, function):
+        """Return RecordSet for function applied to self and other.
+
+        function - one of operator.and_, or_, xor, or sub, or the in-place
+        versions iand, ior, ixor, or isub, which put the answer in self.
+
+        Only segments present in self or other are visited, and a segment
+        missing from one side is copied or ignored as function requires.
+
+        """
+        if not isinstance(other, RecordSet):
+            raise TypeError("RecordSet can be combined only with a RecordSet")
+        inplace = function in (
+            operator.iand,
+            operator.ior,
+            operator.ixor,
+            operator.isub,
+        )
+        if function in (operator.and_, operator.iand):
+            numbers = self.segments.keys() & other.segments.keys()
+        elif function in (operator.sub, operator.isub):
+            numbers = self.segments.keys()
+        else:
+            numbers = self.segments.keys() | other.segments.keys()
+        segments = {}
+        for segment_number in numbers:
+            left = self.segments.get(segment_number)
+            right = other.segments.get(segment_number)
+            if left is None:
+                segment = right.copy()
+            elif right is None:
+                segment = left if inplace else left.copy()
+            else:
+                segment = function(left, right)
+            if len(segment):
+                segments[segment_number] = segment
+        result = self if inplace else self.__class__()
+        result.segments = segments
+        result._segment_numbers = sorted(segments)
+        return result
+
+    def _group_by_segment(self, numbers):
+        """Return list of (segment number, record numbers) pairs.
+
+        A range, or an array in ascending order, is paired with each
+        segment number it spans.
+
+        """
+        if isinstance(numbers, (range, array)):
+            if not len(numbers):
+                return []
+            first, last = sorted((numbers[0], numbers[-1]))
+            return [
+                (segment_number, numbers)
+                for segment_number in range(
+                    self.segment_class.locate(first)[0],
+                    self.segment_class.locate(last)[0] + 1,
+                )
+            ]
+        groups = {}
+        for number in numbers:
+            groups.setdefault(self.segment_class.locate(number)[0], []).append(
+                number
+            )
+        return list(groups.items())
+
+    def _insert_segment(self, segment):
+        """Add segment to the record set's segments."""
+        self.segments[segment.segment] = segment
+        bisect.insort(self._segment_numbers, segment.segment)
+
+    def _delete_segment(self, segment_number):
+        """Remove segment segment_number from the record set's segments."""
+        del self.segments[segment_number]
+        del self._segment_numbers[
+            bisect.bisect_left(self._segment_numbers, segment_number)
+        ]
@@ -0,0 +1,226 @@
+# indexmapbenchmark.py
+# Copyright 2026 Roger Marsh
+# Licence: See LICENCE (BSD licence)
+
+"""Measure indexmap.Segment operations at a range of densities.
+
+Run as 'python -m solentware_misc.core.indexmapbenchmark' to print one JSON
+object per line: a header describing the environment followed by one line
+per workload, density, and operation.  Times are the best of the repeats,
+in seconds, so results from different runs can be compared to catch
+regressions, and the bytes figures show where the set and bitmap sizes
+cross to guide the choice of MAPSIZE.
+
+"""
+
+import argparse
+import json
+import random
+import sys
+import time
+
+from . import indexmap
+
+WORKLOADS = ("sequential", "clustered", "random")
+DENSITIES = (0.001, 0.01, 0.03, 0.05, 0.1, 0.25, 0.5, 0.9)
+CLUSTERSIZE = 64  # record numbers per cluster in clustered workload
+
+
+def workload_offsets(workload, density, seed=0):
+    """Return list of positions in segment for workload at density.
+
+    workload - one of WORKLOADS.
+    density - fraction of the segment's record numbers present.
+    seed - seed for the random number generator.
+
+    """
+    size = indexmap.SEGMENTSIZE
+    count = max(1, int(size * density))
+    rng = random.Random(seed)
+    if workload == "sequential":
+        return list(range(count))
+    if workload == "clustered":
+        clusters = rng.sample(
+            range(size // CLUSTERSIZE), max(1, count // CLUSTERSIZE)
+        )
+        return sorted(
+            position
+            for cluster in clusters
+            for position in range(
+                cluster * CLUSTERSIZE, (cluster + 1) * CLUSTERSIZE
+            )
+        )[:count]
+    if workload == "random":
+        return sorted(rng.sample(range(size), count))
+    raise ValueError("".join(("Workload ", repr(workload), " not known")))
+
+
+def _add_one_at_a_time(offsets):
+    """Return Segment built by add_record_number calls."""
+    segment = indexmap.Segment(0)
+    for number in offsets:
+        segment.add_record_number(number)
+    return segment
+
+
+def _add_many(offsets):
+    """Return Segment built by one add_many call."""
+    segment = indexmap.Segment(0)
+    segment.add_many(offsets)
+    return segment
+
+
+def _remove_half(segment, offsets):
+    """Remove every second record number by remove_record_number calls."""
+    for number in offsets[::2]:
+        segment.remove_record_number(number, convert=True)
+
+
+def _operations(offsets):
+    """Return list of (name, setup, operation) for timing on offsets.
+
+    setup is called before each timed call and it's result is passed to
+    operation.
+
+    """
+    segment = indexmap.Segment(0, values=offsets)
+    pickled = segment.pickle_map()
+    encoded = segment.to_bytes()
+
+    def as_set():
+        copy = segment.copy()
+        copy.convert_to_set()
+        return copy
+
+    def as_bitmap():
+        copy = segment.copy()
+        copy.convert_to_bitmap()
+        return copy
+
+    return [
+        ("add_record_number", lambda: offsets, _add_one_at_a_time),
+        ("add_many", lambda: offsets, _add_many),
+        (
+            "remove_record_number",
+            segment.copy,
+            lambda copy: _remove_half(copy, offsets),
+        ),
+        ("convert_to_bitmap", as_set, lambda copy: copy.convert_to_bitmap()),
+        ("convert_to_set", as_bitmap, lambda copy: copy.convert_to_set()),
+        (
+            "get_record_numbers",
+            segment.copy,
+            lambda copy: copy.get_record_numbers(),
+        ),
+        ("pickle_map", segment.copy, lambda copy: copy.pickle_map()),
+        (
+            "unpickle",
+            lambda: pickled,
+            lambda data: indexmap.Segment(0, pickled=data),
+        ),
+        ("to_bytes", segment.copy, lambda copy: copy.to_bytes()),
+        (
+            "from_bytes",
+            lambda: encoded,
+            lambda data: indexmap.Segment.from_bytes(0, data),
+        ),
+    ]
+
+
+def _best_time(setup, operation, repeat):
+    """Return best time in seconds of repeat calls of operation."""
+    best = None
+    for _ in range(repeat):
+        argument = setup()
+        start = time.perf_counter()
+        operation(argument)
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def run(workloads=WORKLOADS, densities=DENSITIES, repeat=5, seed=0):
+    """Yield dicts of benchmark results, the first describing environment.
+
+    workloads - names from WORKLOADS.
+    densities - fractions of the segment's record numbers present.
+    repeat - number of timings of each operation, the best is reported.
+    seed - seed for random workloads.
+
+    """
+    yield {
+        "benchmark": "indexmap",
+        "python": sys.version.split()[0],
+        "numpy": indexmap.numpy is not None,
+        "mapsize": indexmap.MAPSIZE,
+        "segmentsize": indexmap.SEGMENTSIZE,
+        "repeat": repeat,
+        "seed": seed,
+    }
+    for workload in workloads:
+        for density in densities:
+            offsets = workload_offsets(workload, density, seed=seed)
+            segment = indexmap.Segment(0, values=offsets)
+            bitmap = segment.copy()
+            bitmap.convert_to_bitmap()
+            as_set = segment.copy()
+            as_set.convert_to_set()
+            common = {
+                "workload": workload,
+                "density": density,
+                "count": len(segment),
+                "representation": type(segment.values).__name__,
+                "pickle_set_bytes": len(as_set.pickle_map()),
+                "pickle_bitmap_bytes": len(bitmap.pickle_map()),
+                "to_bytes_bytes": len(segment.to_bytes()),
+            }
+            for name, setup, operation in _operations(offsets):
+                result = dict(common)
+                result["operation"] = name
+                result["seconds"] = _best_time(setup, operation, repeat)
+                yield result
+
+
+def main(argv=None):
+    """Run the benchmark and write JSON lines to stdout or a file."""
+    parser = argparse.ArgumentParser(
+        prog="python -m solentware_misc.core.indexmapbenchmark",
+        description="Time indexmap.Segment operations at several densities.",
+    )
+    parser.add_argument(
+        "--workload",
+        action="append",
+        choices=WORKLOADS,
+        help="workload to run, may be repeated, default all",
+    )
+    parser.add_argument(
+        "--density",
+        action="append",
+        type=float,
+        help="fraction of segment present, may be repeated, default several",
+    )
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--output", help="file for JSON lines, default standard output"
+    )
+    args = parser.parse_args(argv)
+    results = run(
+        workloads=args.workload or WORKLOADS,
+        densities=args.density or DENSITIES,
+        repeat=args.repeat,
+        seed=args.seed,
+    )
+    if args.output is None:
+        for result in results:
+            print(json.dumps(result, sort_keys=True))
+        return
+    with open(args.output, "w", encoding="utf-8") as output:
+        for result in results:
+            output.write(json.dumps(result, sort_keys=True))
+            output.write("\n")
+
+
+if __name__ == "__main__":
+    main()
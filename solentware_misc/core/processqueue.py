@@ -0,0 +1,220 @@
+# processqueue.py
+# Copyright 2026 Roger Marsh
+# Licence: See LICENCE (BSD licence)
+
+"""Provide the ProcessCallQueue class to run methods in other processes.
+
+Methods are taken from the queue in the same way as by CallThreadQueue but
+each thread hands it's method to a process pool and waits for the answer.
+CPU-bound methods then do not hold the interpreter lock of the process
+running the user interface.
+
+Methods, and their arguments, must be picklable.  A log widget passed as
+the logwidget keyword argument is replaced by a ProcessLog which sends the
+text appended in the worker process back to the log widget.  The log widget
+is released when the last task given it has finished and it's text has been
+appended.
+
+"""
+
+import threading
+import multiprocessing
+import functools
+from concurrent import futures
+
+from . import callthreadqueue
+
+# The queue, in a worker process, on which ProcessLog puts log entries.
+_log_queue = None
+
+
+def _initialise_process(log_queue):
+    """Note the queue for log entries in a new worker process."""
+    global _log_queue
+    _log_queue = log_queue
+
+
+class ProcessLog:
+    """Stand in for a log widget in a worker process.
+
+    Text appended is put on a queue read by a thread in the process which
+    owns the log widget.  The log widget is expected to cope with being
+    called from a thread other than the main thread, as tasklog.LogText
+    does.
+
+    The queue is a multiprocessing.SimpleQueue so the text is on the queue
+    before the method using the ProcessLog returns it's result.
+
+    """
+
+    def __init__(self, identity):
+        """Note identity of log widget in process which owns it."""
+        self.identity = identity
+
+    def append_text(self, text, timestamp=True):
+        """Append text to the log widget with timestamp by default."""
+        _log_queue.put((self.identity, "append_text", text, timestamp))
+
+    def append_bytestring(self, text, timestamp=True):
+        """Append bytestring to the log widget with timestamp by default."""
+        _log_queue.put((self.identity, "append_bytestring", text, timestamp))
+
+    def append_text_only(self, text):
+        """Append text to the log widget without timestamp."""
+        self.append_text(text, timestamp=False)
+
+    def append_bytestring_only(self, text):
+        """Append bytestring to the log widget without timestamp."""
+        self.append_bytestring(text, timestamp=False)
+
+
+class ProcessCallQueue(callthreadqueue.CallThreadQueue):
+    """Provide a queue of methods run in a pool of processes.
+
+    The threads taking methods from the queue wait for the processes so the
+    number of methods running at the same time is the number of workers.
+
+    """
+
+    def __init__(self, *, workers=1, maxsize=1, metrics=None, processes=None):
+        """Create the queue, threads, and process pool.
+
+        workers - number of threads running methods from the queue.
+        maxsize - maximum size of the queue, 0 means no limit.
+        metrics - TaskMetrics instance recording tasks, default a new one.
+        processes - number of processes in pool, default workers.
+
+        """
+        super().__init__(workers=workers, maxsize=maxsize, metrics=metrics)
+        self._log_queue = multiprocessing.SimpleQueue()
+        self._log_widgets = {}
+        self._log_widgets_lock = threading.Lock()
+        self.executor = futures.ProcessPoolExecutor(
+            max_workers=workers if processes is None else processes,
+            initializer=_initialise_process,
+            initargs=(self._log_queue,),
+        )
+        self._relay_thread = threading.Thread(
+            target=self._relay_log, daemon=True
+        )
+        self._relay_thread.start()
+
+    def shutdown(self, wait=True, timeout=None, cancel_pending=False):
+        """Stop the threads, as CallThreadQueue.shutdown, and process pool.
+
+        The process pool and log relay are stopped if the threads stop, and
+        the log queue is closed if wait is True and the relay has stopped.
+
+        """
+        stopped = super().shutdown(
+            wait=wait, timeout=timeout, cancel_pending=cancel_pending
+        )
+        if stopped and self._relay_thread.is_alive():
+            self.executor.shutdown(wait=wait)
+            self._log_queue.put(None)
+            if wait:
+                self._relay_thread.join(timeout)
+                if not self._relay_thread.is_alive():
+                    self._log_queue.close()
+        return stopped
+
+    def _relay_log(self):
+        """Pass log entries from worker processes to the log widgets.
+
+        An entry with method None means a task given the log widget has
+        finished.
+
+        """
+        while True:
+            entry = self._log_queue.get()
+            if entry is None:
+                break
+            identity, method, text, timestamp = entry
+            if method is None:
+                self._release_log_widget(identity)
+                continue
+            with self._log_widgets_lock:
+                logwidget = self._log_widgets[identity][0]
+            getattr(logwidget, method)(text, timestamp=timestamp)
+
+    def _hold_log_widget(self, logwidget):
+        """Note a task is given logwidget and return it's identity."""
+        identity = id(logwidget)
+        with self._log_widgets_lock:
+            entry = self._log_widgets.setdefault(identity, [logwidget, 0])
+            entry[1] += 1
+        return identity
+
+    def _release_log_widget(self, identity):
+        """Forget log widget identity if no task holds it any longer."""
+        with self._log_widgets_lock:
+            entry = self._log_widgets[identity]
+            entry[1] -= 1
+            if not entry[1]:
+                del self._log_widgets[identity]
+
+    def _release_if_cancelled(self, identity, future):
+        """Release log widget identity if future was cancelled before run."""
+        if future.cancelled():
+            self._release_log_widget(identity)
+
+    def _run_in_process(self, method, args, kwargs, identity=None):
+        """Run method(*args, **kwargs) in a pool process and return result.
+
+        identity - of the log widget given to method, or None.
+
+        The entry saying the task has finished follows any text appended by
+        method on the log queue, so the log widget is released after that
+        text is appended.
+
+        """
+        try:
+            return self.executor.submit(method, *args, **kwargs).result()
+        finally:
+            if identity is not None:
+                self._log_queue.put((identity, None, None, None))
+
+    def put_method(
+        self,
+        method,
+        args=(),
+        kwargs=None,
+        priority=0,
+        key=None,
+        block=True,
+        name=None,
+    ):
+        """Append the method and it's arguments to the queue.
+
+        The arguments are as for CallThreadQueue.put_method, except a
+        logwidget item in kwargs is replaced by a ProcessLog for the widget.
+
+        """
+        kwargs = {} if kwargs is None else dict(kwargs)
+        logwidget = kwargs.get("logwidget")
+        identity = None
+        if logwidget is not None:
+            identity = self._hold_log_widget(logwidget)
+            kwargs["logwidget"] = ProcessLog(identity)
+        try:
+            future = super().put_method(
+                self._run_in_process,
+                args=(method, args, kwargs, identity),
+                priority=priority,
+                key=key,
+                block=block,
+                name=(
+                    getattr(method, "__qualname__", repr(method))
+                    if name is None
+                    else name
+                ),
+            )
+        except BaseException:
+            if identity is not None:
+                self._release_log_widget(identity)
+            raise
+        if identity is not None:
+            future.add_done_callback(
+                functools.partial(self._release_if_cancelled, identity)
+            )
+        return future
@@ -0,0 +1,178 @@
+# segmentfile.py
+# Copyright 2026 Roger Marsh
+# Licence: See LICENCE (BSD licence)
+
+"""Provide the SegmentFile class to store Segment bitmaps in fixed pages.
+
+The bitmap for segment number n is in the page starting at n * pagesize in
+the file, where pagesize is PAGESIZE by default.  The file is accessed
+through mmap so reading a segment pages in only the page for that segment.
+
+"""
+
+import os
+import mmap
+
+from . import indexmap
+
+PAGESIZE = 8192  # DPT page size
+BITMAPSIZE = indexmap.SEGMENTSIZE // 8  # bytes of page used for bitmap
+
+
+class SegmentFile:
+    """Store Segment bitmaps in fixed size pages of a memory-mapped file.
+
+    Pages not yet written read as empty segments.  Changes are written to
+    the mapped pages by put_segment and reach the file when the operating
+    system writes them or flush is called.
+
+    """
+
+    def __init__(self, path, segment_class=indexmap.Segment, pagesize=None):
+        """Open path, creating it if it does not exist, and map it.
+
+        path - name of the segment file.
+        segment_class - class of Segment instances returned by get_segment.
+        pagesize - bytes per page, default PAGESIZE or the bitmap size of
+        segment_class if bigger.
+
+        """
+        bitmapsize = segment_class.SEGMENTSIZE // 8
+        if pagesize is None:
+            pagesize = max(PAGESIZE, bitmapsize)
+        elif pagesize < bitmapsize:
+            raise ValueError(
+                "".join(
+                    (
+                        "Page size ",
+                        str(pagesize),
+                        " is too small for bitmap of ",
+                        str(bitmapsize),
+                        " bytes",
+                    )
+                )
+            )
+        self.path = path
+        self.segment_class = segment_class
+        self.pagesize = pagesize
+        self.bitmapsize = bitmapsize
+        self._file = open(path, "r+b" if os.path.exists(path) else "w+b")
+        self._map = None
+        self._map_file()
+
+    def __enter__(self):
+        """Return self."""
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        """Flush and close the segment file."""
+        self.close()
+
+    def __len__(self):
+        """Return number of pages in the segment file."""
+        if self._map is None:
+            return 0
+        return len(self._map) // self.pagesize
+
+    def _map_file(self):
+        """Map the whole file, which cannot be done if it is empty."""
+        size = os.fstat(self._file.fileno()).st_size
+        if size:
+            self._map = mmap.mmap(self._file.fileno(), size)
+
+    def _extend(self, pages):
+        """Extend the file to at least pages pages and map it again.
+
+        BufferError is raised if a view from page_view is still in use.
+
+        """
+        if len(self) >= pages:
+            return
+        if self._map is not None:
+            self._map.flush()
+            self._map.close()
+            self._map = None
+        self._file.truncate(pages * self.pagesize)
+        self._map_file()
+
+    def page_view(self, segment_number):
+        """Return memoryview of bitmap for segment_number, or None.
+
+        None is returned if the page is beyond the end of the file.  The
+        memoryview is of the mapped page itself, so nothing is copied, and
+        it must be released before the file is extended or closed.
+
+        """
+        if segment_number >= len(self):
+            return None
+        start = segment_number * self.pagesize
+        return memoryview(self._map)[start : start + self.bitmapsize]
+
+    def get_segment(self, segment_number):
+        """Return Segment for segment_number decoded from it's page.
+
+        An empty Segment is returned for a page beyond the end of the file.
+        Changes to the Segment are tracked so put_changes() can write them.
+
+        """
+        view = self.page_view(segment_number)
+        if view is None:
+            segment = self.segment_class(segment_number)
+            segment.mark_saved()
+            return segment
+        with view:
+            return self.segment_class.from_bitmap(segment_number, view)
+
+    def put_segment(self, segment):
+        """Write bitmap of segment to the page for it's segment number.
+
+        The segment is marked saved so put_changes() can write later changes.
+
+        """
+        self._extend(segment.segment + 1)
+        start = segment.segment * self.pagesize
+        self._map[start : start + self.bitmapsize] = segment.bitmap_bytes()
+        segment.mark_saved()
+
+    def put_changes(self, segment):
+        """Write changes to segment since it was read or last written.
+
+        Only the changed words, or bytes with changed bits, of the page are
+        written.
+
+        """
+        self.apply_delta(segment.segment, segment.delta())
+        segment.mark_saved()
+
+    def apply_delta(self, segment_number, data):
+        """Apply changes in data, from Segment.delta(), to segment's page."""
+        kind, changes = indexmap.decode_delta(data)
+        self._extend(segment_number + 1)
+        start = segment_number * self.pagesize
+        page = self._map
+        if kind == indexmap.FORMATDELTAWORDS:
+            size = self.segment_class.INTEGERSIZE // 8
+            for index, word in changes:
+                offset = start + index * size
+                page[offset : offset + size] = word.to_bytes(size, "little")
+            return
+        added, removed = changes
+        for position in added:
+            page[start + (position >> 3)] |= 1 << (position & 7)
+        for position in removed:
+            page[start + (position >> 3)] &= ~(1 << (position & 7)) & 0xFF
+
+    def flush(self):
+        """Write changed pages to the file."""
+        if self._map is not None:
+            self._map.flush()
+
+    def close(self):
+        """Flush changes, unmap, and close, the segment file."""
+        if self._map is not None:
+            self._map.flush()
+            self._map.close()
+            self._map = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
@@ -5,16 +5,20 @@
 """callthreadqueue tests"""
 
 import unittest
+import threading
+import asyncio
+import time
+from unittest import mock
 
 from .. import callthreadqueue
 
 
 class CallThreadQueue(unittest.TestCase):
     def setUp(self):
-        pass  # self.callthreadqueue = callthreadqueue.CallThreadQueue()
+        self.threads = threading.active_count()
 
     def tearDown(self):
-        pass
+        self.assertEqual(threading.active_count(), self.threads)
 
     def test_001___init___001(self):
         self.assertRaisesRegex(
@@ -29,68 +33,330 @@ class CallThreadQueue(unittest.TestCase):
             *(None,),
         )
 
-    def test_002___call_method_001(self):
-        threadqueue = callthreadqueue.CallThreadQueue()
+    def test_001___init___002(self):
         self.assertRaisesRegex(
-            TypeError,
-            "".join(
-                (
-                    r"__call_method\(\) takes 1 positional argument ",
-                    "but 2 were given$",
-                )
-            ),
-            threadqueue.__call_method,
-            *(None,),
+            ValueError,
+            "CallThreadQueue needs at least 1 worker but 0 requested$",
+            callthreadqueue.CallThreadQueue,
+            **dict(workers=0),
         )
 
+    def test_001___init___003(self):
+        with callthreadqueue.CallThreadQueue(
+            workers=3, maxsize=0
+        ) as threadqueue:
+            self.assertEqual(threadqueue.workers, 3)
+            self.assertEqual(threadqueue.queue.maxsize, 0)
+            barrier = threading.Barrier(3, timeout=10)
+            for _ in range(3):
+                threadqueue.put_method(barrier.wait)
+            threadqueue.queue.join()
+            self.assertEqual(barrier.broken, False)
+
+    def test_001___init___004(self):
+        with callthreadqueue.CallThreadQueue(workers=2) as threadqueue:
+            tasks = threadqueue.queue
+            tasks.put(None)
+            tasks.join()
+            self.assertIs(threadqueue.queue, tasks)
+            tasks.put(None)
+            tasks.join()
+            self.assertIs(threadqueue.queue, None)
+
+    def test_002___call_method_001(self):
+        with callthreadqueue.CallThreadQueue() as threadqueue:
+            self.assertRaisesRegex(
+                TypeError,
+                "".join(
+                    (
+                        r"__call_method\(\) takes 1 positional argument ",
+                        "but 2 were given$",
+                    )
+                ),
+                threadqueue.__call_method,
+                *(None,),
+            )
+
     def test_002___call_method_002(self):
-        threadqueue = callthreadqueue.CallThreadQueue()
-        threadqueue.queue.put((None))
+        with callthreadqueue.CallThreadQueue() as threadqueue:
+            threadqueue.queue.put((None))
 
     def test_002___call_method_003(self):
         def m():
             x = 0
 
-        threadqueue = callthreadqueue.CallThreadQueue()
-        threadqueue.queue.put((m, (), {}))
+        with callthreadqueue.CallThreadQueue() as threadqueue:
+            threadqueue.queue.put((m, (), {}))
 
     def test_003_put_method_001(self):
-        threadqueue = callthreadqueue.CallThreadQueue()
-        self.assertRaisesRegex(
-            TypeError,
-            "".join(
-                (
-                    r"put_method\(\) missing 1 required positional argument: ",
-                    "'method'$",
+        with callthreadqueue.CallThreadQueue() as threadqueue:
+            self.assertRaisesRegex(
+                TypeError,
+                "".join(
+                    (
+                        r"put_method\(\) missing 1 required positional ",
+                        "argument: 'method'$",
+                    )
+                ),
+                threadqueue.put_method,
+            )
+
+    def test_003_put_method_002(self):
+        with callthreadqueue.CallThreadQueue() as threadqueue:
+            self.assertRaisesRegex(
+                TypeError,
+                "".join(
+                    (
+                        r"put_method\(\) got an unexpected keyword argument ",
+                        "'badkey'$",
+                    )
+                ),
+                threadqueue.put_method,
+                *(None,),
+                **dict(args=(), kwargs={}, badkey=None),
+            )
+
+    def test_003_put_method_003(self):
+        def m():
+            x = 0
+
+        with callthreadqueue.CallThreadQueue() as threadqueue:
+            threadqueue.put_method(m)
+
+    def test_003_put_method_004(self):
+        with callthreadqueue.CallThreadQueue() as threadqueue:
+            future = threadqueue.put_method(max, args=(3, 4))
+            self.assertIsInstance(future, callthreadqueue.TaskFuture)
+            self.assertEqual(future.result(timeout=10), 4)
+            self.assertGreaterEqual(future.wait_time(), 0)
+            self.assertGreaterEqual(future.run_time(), 0)
+
+    def test_003_put_method_005(self):
+        with callthreadqueue.CallThreadQueue() as threadqueue:
+            failed = threadqueue.put_method(int, args=("x",))
+            self.assertIsInstance(failed.exception(timeout=10), ValueError)
+            self.assertGreaterEqual(failed.run_time(), 0)
+            future = threadqueue.put_method(dict, kwargs=dict(a=1))
+            self.assertEqual(future.result(timeout=10), {"a": 1})
+
+    def test_003_put_method_006(self):
+        with callthreadqueue.CallThreadQueue(maxsize=0) as threadqueue:
+            event = threading.Event()
+            threadqueue.put_method(event.wait, args=(10,))
+            future = threadqueue.put_method(max, args=(3, 4))
+            self.assertEqual(future.cancel(), True)
+            event.set()
+            threadqueue.queue.join()
+            self.assertEqual(future.cancelled(), True)
+            self.assertEqual(future.wait_time(), None)
+            self.assertEqual(future.run_time(), None)
+
+    def test_003_put_method_007(self):
+        with callthreadqueue.CallThreadQueue() as threadqueue:
+            with mock.patch.object(callthreadqueue.sys, "excepthook") as hook:
+                threadqueue.queue.put((int, ("x",), {}))
+                threadqueue.queue.join()
+            self.assertEqual(hook.call_count, 1)
+            self.assertIs(hook.call_args[0][0], ValueError)
+            future = threadqueue.put_method(max, args=(3, 4))
+            self.assertEqual(future.result(timeout=10), 4)
+
+    def test_003_put_method_008(self):
+        with callthreadqueue.CallThreadQueue(maxsize=0) as threadqueue:
+            event = threading.Event()
+            order = []
+            threadqueue.put_method(event.wait, args=(10,))
+            for priority, name in (0, "bulk"), (-1, "urgent"), (0, "later"):
+                threadqueue.put_method(
+                    order.append, args=(name,), priority=priority
                 )
-            ),
+            event.set()
+            threadqueue.queue.join()
+            self.assertEqual(order, ["urgent", "bulk", "later"])
+
+    def test_003_put_method_009(self):
+        with callthreadqueue.CallThreadQueue() as threadqueue:
+            event = threading.Event()
+            order = []
+            threadqueue.put_method(event.wait, args=(10,))
+            first = threadqueue.put_method(
+                order.append, args=(1,), key="refresh"
+            )
+            second = threadqueue.put_method(
+                order.append, args=(2,), key="refresh"
+            )
+            self.assertEqual(threadqueue.queue.qsize(), 1)
+            self.assertRaises(
+                callthreadqueue.queue.Full,
+                threadqueue.queue.put,
+                *(None, False),
+            )
+            event.set()
+            threadqueue.queue.join()
+            self.assertEqual(order, [2])
+            self.assertEqual(first.cancelled(), True)
+            self.assertEqual(second.result(timeout=10), None)
+
+    def test_004_submit_001(self):
+        with callthreadqueue.CallThreadQueue(
+            workers=2, maxsize=0
+        ) as threadqueue:
+
+            async def main():
+                return await asyncio.gather(
+                    threadqueue.submit(max, 3, 4),
+                    threadqueue.submit(dict, a=1),
+                )
+
+            self.assertEqual(asyncio.run(main()), [4, {"a": 1}])
+
+    def test_004_submit_002(self):
+        with callthreadqueue.CallThreadQueue() as threadqueue:
+            event = threading.Event()
+            threadqueue.put_method(event.wait, args=(10,))
+            threadqueue.put_method(event.wait, args=(10,))
+
+            async def main():
+                return await threadqueue.submit(max, 3, 4)
+
+            self.assertRaises(callthreadqueue.queue.Full, asyncio.run, main())
+            event.set()
+
+    def test_005_shutdown_001(self):
+        done = []
+        with callthreadqueue.CallThreadQueue(maxsize=0) as threadqueue:
+            for number in range(5):
+                threadqueue.put_method(done.append, args=(number,))
+        self.assertEqual(done, [0, 1, 2, 3, 4])
+        self.assertIs(threadqueue.queue, None)
+        self.assertEqual(threadqueue.shutdown(), True)
+        self.assertRaisesRegex(
+            RuntimeError,
+            "Cannot put method when threads have stopped$",
             threadqueue.put_method,
+            *(max, (1, 2)),
         )
 
-    def test_003_put_method_002(self):
-        threadqueue = callthreadqueue.CallThreadQueue()
+    def test_005_shutdown_002(self):
+        threadqueue = callthreadqueue.CallThreadQueue(workers=2, maxsize=1)
+        event = threading.Event()
+        running = [threadqueue.put_method(event.wait, args=(10,))]
+        running.append(threadqueue.put_method(event.wait, args=(10,)))
+        pending = threadqueue.put_method(max, args=(1, 2))
+        self.assertEqual(
+            threadqueue.shutdown(timeout=0.01, cancel_pending=True), False
+        )
+        self.assertEqual(pending.cancelled(), True)
         self.assertRaisesRegex(
-            TypeError,
-            "".join(
-                (
-                    r"put_method\(\) got an unexpected keyword argument ",
-                    "'badkey'$",
-                )
-            ),
+            RuntimeError,
+            "Cannot put entry on closed TaskQueue$",
             threadqueue.put_method,
-            *(None,),
-            **dict(args=(), kwargs={}, badkey=None),
+            *(max, (1, 2)),
         )
+        event.set()
+        self.assertEqual(threadqueue.shutdown(), True)
+        self.assertEqual([f.result() for f in running], [True, True])
 
-    def test_003_put_method_003(self):
-        def m():
-            x = 0
+    def test_006_stats_001(self):
+        records = []
+        metrics = callthreadqueue.TaskMetrics(
+            history=3, callback=records.append
+        )
+        with callthreadqueue.CallThreadQueue(metrics=metrics) as threadqueue:
+            event = threading.Event()
+            threadqueue.put_method(event.wait, args=(10,), name="wait")
+            threadqueue.put_method(int, args=("x",))
+            self.assertRaises(
+                callthreadqueue.queue.Full,
+                threadqueue.put_method,
+                *(max, (1, 2)),
+                **dict(block=False),
+            )
+            event.set()
+            threadqueue.put_method(max, args=(1, 2))
+        stats = threadqueue.stats()
+        self.assertEqual(
+            stats["outcomes"],
+            {
+                callthreadqueue.DONE: 2,
+                callthreadqueue.FAILED: 1,
+                callthreadqueue.REJECTED: 1,
+            },
+        )
+        self.assertEqual(stats["recent"], 3)
+        self.assertEqual(stats["bounds"], callthreadqueue.HISTOGRAMBOUNDS)
+        self.assertEqual(stats["run"]["count"], 3)
+        self.assertEqual(sum(stats["run"]["histogram"]), 3)
+        self.assertEqual(sum(stats["wait"]["histogram"]), 3)
+        self.assertEqual(
+            {name: entry["count"] for name, entry in stats["names"].items()},
+            {"wait": 1, "max": 1, "int": 1},
+        )
+        self.assertEqual(
+            [(r["name"], r["outcome"]) for r in records],
+            [
+                ("max", callthreadqueue.REJECTED),
+                ("wait", callthreadqueue.DONE),
+                ("int", callthreadqueue.FAILED),
+                ("max", callthreadqueue.DONE),
+            ],
+        )
+        self.assertEqual(records[0]["wait"], None)
+
+
+class TaskToken(unittest.TestCase):
+    def setUp(self):
+        self.threads = threading.active_count()
+
+    def tearDown(self):
+        self.assertEqual(threading.active_count(), self.threads)
 
-        threadqueue = callthreadqueue.CallThreadQueue()
-        threadqueue.put_method(m)
+    def test_001_cancel_001(self):
+        token = callthreadqueue.TaskToken()
+        self.assertEqual(token.cancelled, False)
+        token.check()
+        token.cancel()
+        self.assertEqual(token.cancelled, True)
+        self.assertRaisesRegex(
+            callthreadqueue.TaskCancelled, "Task cancelled$", token.check
+        )
+
+    def test_001_cancel_002(self):
+        token = callthreadqueue.TaskToken()
+        started = threading.Event()
+
+        def task(token=None):
+            started.set()
+            while True:
+                token.check()
+                time.sleep(0.001)
+
+        with callthreadqueue.CallThreadQueue() as threadqueue:
+            future = threadqueue.put_method(task, kwargs=dict(token=token))
+            started.wait(10)
+            token.cancel()
+            self.assertIsInstance(
+                future.exception(timeout=10), callthreadqueue.TaskCancelled
+            )
+        self.assertEqual(
+            threadqueue.stats()["outcomes"], {callthreadqueue.CANCELLED: 1}
+        )
+
+    def test_002_report_001(self):
+        reports = []
+        token = callthreadqueue.TaskToken(
+            reporter=lambda *args: reports.append(args), interval=3600
+        )
+        self.assertEqual(token.report(0.1, "first"), False)
+        self.assertEqual(token.report(0.5, "throttled"), False)
+        self.assertEqual((token.fraction, token.message), (0.5, "throttled"))
+        token.cancel()
+        self.assertEqual(token.report(1), True)
+        self.assertEqual(reports, [(0.1, "first"), (1, None)])
 
 
 if __name__ == "__main__":
     runner = unittest.TextTestRunner
     loader = unittest.defaultTestLoader.loadTestsFromTestCase
     runner().run(loader(CallThreadQueue))
+    runner().run(loader(TaskToken))
@@ -0,0 +1,42 @@
+# test_eventloopthread.py
+# Copyright 2026 Roger Marsh
+# Licence: See LICENCE (BSD licence)
+
+"""eventloopthread tests"""
+
+import unittest
+import asyncio
+import threading
+
+from .. import eventloopthread
+
+
+class EventLoopThread(unittest.TestCase):
+    def setUp(self):
+        self.eventloop = eventloopthread.EventLoopThread()
+
+    def tearDown(self):
+        self.eventloop.stop(timeout=10)
+
+    def test_001_put_coroutine_001(self):
+        async def names():
+            await asyncio.sleep(0)
+            return threading.current_thread().name
+
+        futures = [self.eventloop.put_coroutine(names()) for _ in range(5)]
+        threads = {future.result(timeout=10) for future in futures}
+        self.assertEqual(len(threads), 1)
+        self.assertNotEqual(threads, {threading.current_thread().name})
+
+    def test_002_stop_001(self):
+        future = self.eventloop.put_coroutine(asyncio.sleep(3600))
+        self.assertEqual(self.eventloop.stop(timeout=10), True)
+        self.assertEqual(future.cancelled(), True)
+        self.assertEqual(self.eventloop.loop.is_closed(), True)
+        self.assertEqual(self.eventloop.stop(timeout=10), True)
+
+
+if __name__ == "__main__":
+    runner = unittest.TextTestRunner
+    loader = unittest.defaultTestLoader.loadTestsFromTestCase
+    runner().run(loader(EventLoopThread))
@@ -5,6 +5,13 @@
 """indexmap tests"""
 
 import unittest
+import os
+import sys
+import subprocess
+import random
+import operator
+import threading
+from array import array
 
 from .. import indexmap
 
@@ -42,8 +49,807 @@ class Segment(unittest.TestCase):
             **dict(pickled=None, bitmap=False, values=None, badkey=None),
         )
 
+    def test_002_add_record_number_001(self):
+        segment = indexmap.Segment(1)
+        base = indexmap.SEGMENTSIZE
+        for number in range(base, base + indexmap.MAPSIZE * 2, 2):
+            segment.add_record_number(number)
+        self.assertIsInstance(segment.values, set)
+        segment.add_record_number(base + indexmap.SEGMENTSIZE - 1)
+        self.assertIsInstance(segment.values, bytearray)
+        segment.add_record_number(0)
+        self.assertEqual(
+            segment.get_record_numbers(),
+            list(range(base, base + indexmap.MAPSIZE * 2, 2))
+            + [base + indexmap.SEGMENTSIZE - 1],
+        )
+
+    def test_003_convert_to_bitmap_001(self):
+        numbers = [0, 31, 32, 1000, indexmap.SEGMENTSIZE - 1]
+        segment = indexmap.Segment(0, values=numbers)
+        segment.convert_to_bitmap()
+        self.assertEqual(
+            int.from_bytes(segment.values, "little"),
+            sum(1 << n for n in numbers),
+        )
+        segment.convert_to_set()
+        self.assertEqual(segment.values, set(numbers))
+
+    def test_004___init___bitmap_words_001(self):
+        words = [0] * indexmap.MAPSIZE
+        for number in (0, 31, 32, indexmap.SEGMENTSIZE - 1):
+            element, bit = divmod(number, indexmap.INTEGERSIZE)
+            words[element] |= indexmap.BITMASK[bit]
+        segment = indexmap.Segment(0, bitmap=True, values=words)
+        self.assertEqual(
+            segment.get_record_numbers(),
+            [0, 31, 32, indexmap.SEGMENTSIZE - 1],
+        )
+        segment = indexmap.Segment(0, pickled=indexmap.pickle.dumps(words, 4))
+        self.assertEqual(
+            segment.get_record_numbers(),
+            [0, 31, 32, indexmap.SEGMENTSIZE - 1],
+        )
+
+    def test_004___init___bitmap_int_001(self):
+        numbers = [0, 31, 32, indexmap.SEGMENTSIZE - 1]
+        bitmap = sum(1 << n for n in numbers)
+        segment = indexmap.Segment(0, bitmap=True, values=bitmap)
+        self.assertIsInstance(segment.values, bytearray)
+        self.assertEqual(segment.get_record_numbers(), numbers)
+
+    def test_004_pickle_map_001(self):
+        numbers = [0, 31, 32, indexmap.SEGMENTSIZE - 1]
+        words = [0] * indexmap.MAPSIZE
+        words[0] = 1 - (1 << 31)
+        words[1] = 1
+        words[-1] = -(1 << 31)
+        bitmap = indexmap.Segment(
+            0, bitmap=True, values=sum(1 << n for n in numbers)
+        )
+        self.assertEqual(indexmap.pickle.loads(bitmap.pickle_map()), words)
+        segment = indexmap.Segment(0, pickled=bitmap.pickle_map())
+        self.assertIsInstance(segment.values, bytearray)
+        self.assertEqual(segment.get_record_numbers(), numbers)
+        runs = indexmap.Segment(0, values=range(100, 200))
+        self.assertIsInstance(runs.values, indexmap.array)
+        self.assertEqual(
+            indexmap.pickle.loads(runs.pickle_map()), set(range(100, 200))
+        )
+        runs = indexmap.Segment(0, values=range(0, 4000))
+        self.assertEqual(
+            indexmap.pickle.loads(runs.pickle_map())[:125],
+            [-1] * 125,
+        )
+
+    def test_005_add_remove_bitmap_001(self):
+        segment = indexmap.Segment(0, values=range(0, indexmap.SEGMENTSIZE, 2))
+        values = segment.values
+        self.assertIsInstance(values, bytearray)
+        segment.add_record_number(1)
+        segment.remove_record_number(2)
+        self.assertIs(segment.values, values)
+        self.assertEqual(values[0], 0b01010011)
+        self.assertEqual(len(segment), indexmap.SEGMENTSIZE // 2)
+
+    def test_005_remove_record_number_001(self):
+        segment = indexmap.Segment(0, values=range(0, indexmap.SEGMENTSIZE, 2))
+        self.assertIsInstance(segment.values, bytearray)
+        for number in range(0, indexmap.SEGMENTSIZE - 2 * indexmap.MAPSIZE, 2):
+            segment.remove_record_number(number, convert=True)
+        self.assertIsInstance(segment.values, bytearray)
+        segment.remove_record_number(indexmap.SEGMENTSIZE - 2, convert=True)
+        self.assertIsInstance(segment.values, set)
+        self.assertEqual(len(segment.values), indexmap.MAPSIZE - 1)
+
+    def test_006_get_record_numbers_001(self):
+        segment = indexmap.Segment(0, values=range(indexmap.SEGMENTSIZE))
+        self.assertEqual(
+            segment.get_record_numbers(), list(range(indexmap.SEGMENTSIZE))
+        )
+
+    def test_007_set_algebra_001(self):
+        rng = random.Random(7)
+        size = indexmap.SEGMENTSIZE
+        sparse = set(rng.sample(range(size), 500))
+        dense = set(rng.sample(range(size), 30000))
+        overlap = set(rng.sample(sorted(dense), 400))
+        operations = (
+            (operator.and_, operator.iand),
+            (operator.or_, operator.ior),
+            (operator.xor, operator.ixor),
+            (operator.sub, operator.isub),
+        )
+        for left in (sparse, dense, overlap):
+            for right in (sparse, dense, overlap):
+                for function, inplace in operations:
+                    expected = sorted(size + n for n in function(left, right))
+                    lseg = indexmap.Segment(1, values=left)
+                    rseg = indexmap.Segment(1, values=right)
+                    result = function(lseg, rseg)
+                    self.assertEqual(result.get_record_numbers(), expected)
+                    self.assertEqual(
+                        lseg.get_record_numbers(),
+                        sorted(size + n for n in left),
+                    )
+                    self.assertIs(inplace(lseg, rseg), lseg)
+                    self.assertEqual(lseg.get_record_numbers(), expected)
+                    self.assertEqual(
+                        isinstance(lseg.values, set),
+                        len(expected) <= indexmap.MAPSIZE,
+                    )
+
+    def test_007_set_algebra_002(self):
+        self.assertRaisesRegex(
+            ValueError,
+            "Segment 1 cannot be combined with segment 2$",
+            operator.and_,
+            *(indexmap.Segment(1), indexmap.Segment(2)),
+        )
+
+    def test_008___len___001(self):
+        segment = indexmap.Segment(0)
+        self.assertEqual(len(segment), 0)
+        for number in range(0, (indexmap.MAPSIZE + 10) * 2, 2):
+            segment.add_record_number(number)
+            segment.add_record_number(number)
+        self.assertIsInstance(segment.values, bytearray)
+        self.assertEqual(len(segment), indexmap.MAPSIZE + 10)
+        segment.remove_record_number(10)
+        segment.remove_record_number(10)
+        self.assertEqual(len(segment), indexmap.MAPSIZE + 9)
+        for number in range(20, 40, 2):
+            segment.remove_record_number(number, convert=True)
+        self.assertIsInstance(segment.values, set)
+        self.assertEqual(len(segment), indexmap.MAPSIZE - 1)
+        self.assertEqual(len(segment), len(segment.get_record_numbers()))
+        other = indexmap.Segment(0, values=range(0, 10000, 3))
+        self.assertEqual(
+            len(segment | other), len(segment.values | set(range(0, 10000, 3)))
+        )
+        segment &= other
+        self.assertEqual(len(segment), len(segment.get_record_numbers()))
+
+    def test_009_to_bytes_001(self):
+        rng = random.Random(9)
+        size = indexmap.SEGMENTSIZE
+        for values, kind in (
+            (set(), indexmap.FORMATFIXEDLIST),
+            (set(rng.sample(range(size), 300)), indexmap.FORMATFIXEDLIST),
+            (set(range(100, 5000)), indexmap.FORMATFIXEDRUNS),
+            (set(range(0, size, 2)), indexmap.FORMATBITMAP),
+        ):
+            segment = indexmap.Segment(2, values=values)
+            data = segment.to_bytes()
+            self.assertEqual(data[0], indexmap.FORMATVERSION)
+            self.assertEqual(data[1], kind)
+            copy = indexmap.Segment.from_bytes(2, memoryview(data))
+            self.assertEqual(
+                copy.get_record_numbers(), segment.get_record_numbers()
+            )
+            self.assertEqual(len(copy), len(segment))
+            self.assertIs(type(copy.values), type(segment.values))
+
+    def test_009_from_bytes_001(self):
+        for values in ({1, 2, 3}, range(0, indexmap.SEGMENTSIZE, 3)):
+            segment = indexmap.Segment(0, values=values)
+            copy = indexmap.Segment.from_bytes(0, segment.pickle_map())
+            self.assertEqual(
+                copy.get_record_numbers(), segment.get_record_numbers()
+            )
+
+    def test_009_to_bytes_002(self):
+        segment = indexmap.Segment(0, values=range(0, 2000, 2))
+        segment.convert_to_bitmap()
+        self.assertEqual(
+            segment.to_bytes(),
+            bytes((indexmap.FORMATVERSION, indexmap.FORMATFIXEDLIST))
+            + b"".join(n.to_bytes(2, "little") for n in range(0, 2000, 2)),
+        )
+        copy = indexmap.Segment.from_bytes(0, segment.to_bytes())
+        self.assertIsInstance(copy.values, set)
+        self.assertEqual(len(copy), 1000)
+
+    def test_009_from_bytes_002(self):
+        self.assertRaisesRegex(
+            ValueError,
+            "Segment format version 99 is not supported$",
+            indexmap.Segment.from_bytes,
+            *(0, b"\x63\x00"),
+        )
+        self.assertRaisesRegex(
+            ValueError,
+            "Segment format kind 1 is not supported$",
+            indexmap.Segment.from_bytes,
+            *(0, b"\x01\x01\x03"),
+        )
+
+    def test_010_runs_001(self):
+        size = indexmap.SEGMENTSIZE
+        segment = indexmap.Segment(1)
+        for number in range(size + 100, size + 5000):
+            segment.add_record_number(number)
+        self.assertIsInstance(segment.values, indexmap.array)
+        self.assertEqual(list(segment.values), [100, 5000])
+        for number in (size + 99, size + 5000, size + 10, size + 12):
+            segment.add_record_number(number)
+        segment.add_record_number(size + 11)
+        self.assertEqual(list(segment.values), [10, 13, 99, 5001])
+        segment.remove_record_number(size + 1000)
+        segment.remove_record_number(size + 1000)
+        segment.remove_record_number(size + 99)
+        segment.remove_record_number(size + 5000)
+        self.assertEqual(list(segment.values), [10, 13, 100, 1000, 1001, 5000])
+        self.assertEqual(len(segment), 3 + 4899)
+        self.assertEqual(
+            segment.get_record_numbers(),
+            [size + n for n in range(10, 13)]
+            + [size + n for n in range(100, 5000) if n != 1000],
+        )
+        copy = indexmap.Segment.from_bytes(1, segment.to_bytes())
+        self.assertEqual(list(copy.values), list(segment.values))
+        self.assertEqual(len(copy), len(segment))
+
+    def test_010_runs_002(self):
+        segment = indexmap.Segment(0, values=range(10, 20))
+        self.assertIsInstance(segment.values, indexmap.array)
+        for number in range(10, 20, 2):
+            segment.remove_record_number(number)
+        self.assertIsInstance(segment.values, set)
+        self.assertEqual(segment.values, set(range(11, 20, 2)))
+        segment = indexmap.Segment(0, values=range(0, 30000))
+        segment |= indexmap.Segment(0, values=range(0, 65000, 2))
+        self.assertIsInstance(segment.values, bytearray)
+        self.assertEqual(len(segment), 30000 + 17500)
+        segment -= indexmap.Segment(0, values=range(30000, 65280))
+        self.assertIsInstance(segment.values, indexmap.array)
+        self.assertEqual(list(segment.values), [0, 30000])
+
+    def test_010_runs_003(self):
+        size = indexmap.MAPSIZE + 10
+        segment = indexmap.Segment(0, bitmap=True, values=(1 << size) - 1)
+        for number in range(size - 1, indexmap.MAPSIZE - 1, -1):
+            segment.remove_record_number(number, convert=True)
+            self.assertIsInstance(segment.values, bytearray)
+        segment.remove_record_number(indexmap.MAPSIZE - 1, convert=True)
+        self.assertIsInstance(segment.values, indexmap.array)
+        self.assertEqual(list(segment.values), [0, indexmap.MAPSIZE - 1])
+
+    def test_011___contains___001(self):
+        size = indexmap.SEGMENTSIZE
+        for values in ({3, 9}, range(3, 9), range(3, size, 2)):
+            segment = indexmap.Segment(1, values=values)
+            for number in range(12):
+                self.assertEqual(size + number in segment, number in values)
+            self.assertNotIn(3, segment)
+
+    def test_012_copy_001(self):
+        for values in ({3, 9}, range(3, 9), range(3, 30000, 2)):
+            segment = indexmap.Segment(1, values=values)
+            copy = segment.copy()
+            segment.add_record_number(indexmap.SEGMENTSIZE + 10)
+            self.assertEqual(len(copy), len(values))
+            self.assertEqual(
+                copy.get_record_numbers(),
+                [indexmap.SEGMENTSIZE + n for n in sorted(values)],
+            )
+
+    def test_013_add_many_001(self):
+        size = indexmap.SEGMENTSIZE
+        for numbers in (
+            range(size - 10, size * 2 + 10, 3),
+            range(size * 2 + 10, size - 10, -3),
+            array("I", range(size - 10, size * 2 + 10, 3)),
+            list(range(size - 10, size * 2 + 10, 3)),
+        ):
+            for values in ((), range(0, 5), range(0, size, 2)):
+                segment = indexmap.Segment(1, values=values)
+                segment.add_many(numbers)
+                expected = {size + n for n in values}.union(
+                    n for n in numbers if size <= n < size * 2
+                )
+                self.assertEqual(
+                    segment.get_record_numbers(), sorted(expected)
+                )
+                self.assertEqual(len(segment), len(expected))
+
+    def test_013_add_many_002(self):
+        segment = indexmap.Segment(0)
+        segment.add_many(range(indexmap.SEGMENTSIZE))
+        self.assertIsInstance(segment.values, indexmap.array)
+        self.assertEqual(len(segment), indexmap.SEGMENTSIZE)
+
+    def test_014_remove_many_001(self):
+        size = indexmap.SEGMENTSIZE
+        for numbers in (
+            range(size - 10, size * 2 + 10, 3),
+            array("I", range(size - 10, size * 2 + 10, 3)),
+            list(range(size - 10, size * 2 + 10, 3)),
+        ):
+            for values in ((), range(0, 5), range(0, size, 2)):
+                segment = indexmap.Segment(1, values=values)
+                segment.remove_many(numbers)
+                expected = {size + n for n in values}.difference(numbers)
+                self.assertEqual(
+                    segment.get_record_numbers(), sorted(expected)
+                )
+                self.assertEqual(len(segment), len(expected))
+
+    def test_014_remove_many_002(self):
+        size = indexmap.SEGMENTSIZE
+        mapsize = indexmap.MAPSIZE
+        segment = indexmap.Segment(1, values=range(0, 2 * (mapsize + 5), 2))
+        segment.mark_saved()
+        values = segment.values
+        self.assertIsInstance(values, bytearray)
+        segment.add_many([size + 1, size + 3, size + 2, size * 2])
+        self.assertIs(segment.values, values)
+        self.assertEqual(len(segment), mapsize + 7)
+        self.assertEqual(
+            indexmap.decode_delta(segment.delta()),
+            (indexmap.FORMATDELTALIST, ([1, 3], [])),
+        )
+        segment.remove_many([size + 1, size + 4, size + 5])
+        self.assertIs(segment.values, values)
+        self.assertEqual(len(segment), mapsize + 5)
+        self.assertEqual(
+            indexmap.decode_delta(segment.delta()),
+            (indexmap.FORMATDELTALIST, ([3], [4])),
+        )
+        segment.remove_many(range(size + 6, size + 20, 2))
+        self.assertIsInstance(segment.values, set)
+        self.assertEqual(len(segment), mapsize - 2)
+        expected = [size, size + 2, size + 3]
+        expected.extend(range(size + 20, size + 2 * (mapsize + 5), 2))
+        self.assertEqual(segment.get_record_numbers(), expected)
+
+    def test_015_iter_record_numbers_001(self):
+        size = indexmap.SEGMENTSIZE
+        for values in (
+            {5, 70, 3000},
+            set(range(100, 200)) | set(range(300, 400)),
+            set(range(0, size, 3)),
+        ):
+            segment = indexmap.Segment(2, values=values)
+            expected = sorted(size * 2 + n for n in values)
+            self.assertEqual(list(segment.iter_record_numbers()), expected)
+            self.assertEqual(
+                list(segment.iter_record_numbers(reverse=True)),
+                expected[::-1],
+            )
+            for start in (0, size * 2 + 70, size * 2 + 150, size * 9):
+                self.assertEqual(
+                    list(segment.iter_record_numbers(start=start)),
+                    [n for n in expected if n >= start],
+                )
+                self.assertEqual(
+                    list(
+                        segment.iter_record_numbers(start=start, reverse=True)
+                    ),
+                    [n for n in expected if n <= start][::-1],
+                )
+
+    def test_015_iter_record_numbers_002(self):
+        for mapsize, integersize in ((512, 8), (64, 64)):
+            segment = indexmap.segment_class(mapsize, integersize)(
+                1, values=range(1, 4096, 7)
+            )
+            self.assertIsInstance(segment.values, bytearray)
+            expected = [4096 + n for n in range(1, 4096, 7)]
+            for start in (4096, 4096 + 63, 4096 + 64, 4096 + 4000, 9000):
+                self.assertEqual(
+                    list(segment.iter_record_numbers(start=start)),
+                    [n for n in expected if n >= start],
+                )
+                self.assertEqual(
+                    list(
+                        segment.iter_record_numbers(start=start, reverse=True)
+                    ),
+                    [n for n in expected if n <= start][::-1],
+                )
+
+    def test_016_first_last_001(self):
+        size = indexmap.SEGMENTSIZE
+        for values in ((), {5, 70}, range(5, 71), range(5, size, 65)):
+            segment = indexmap.Segment(1, values=values)
+            expected = sorted(size + n for n in values)
+            self.assertEqual(
+                segment.first(), expected[0] if expected else None
+            )
+            self.assertEqual(
+                segment.last(), expected[-1] if expected else None
+            )
+            for number in (0, size + 5, size + 6, size + 70, size * 3):
+                after = [n for n in expected if n > number]
+                before = [n for n in expected if n < number]
+                self.assertEqual(
+                    segment.next_after(number), after[0] if after else None
+                )
+                self.assertEqual(
+                    segment.prev_before(number),
+                    before[-1] if before else None,
+                )
+
+    def test_016_first_last_002(self):
+        segment = indexmap.Segment(0, values={10, 20, 30})
+        self.assertEqual(segment.next_after(10), 20)
+        segment.add_record_number(15)
+        self.assertEqual(segment.next_after(10), 15)
+        segment.remove_record_number(15)
+        segment.remove_record_number(20)
+        self.assertEqual(segment.next_after(10), 30)
+        self.assertEqual(segment.prev_before(30), 10)
+        segment.add_many([25])
+        self.assertEqual(list(segment.iter_record_numbers(start=11)), [25, 30])
+
+    def test_017_rank_select_001(self):
+        size = indexmap.SEGMENTSIZE
+        for values in (
+            {5, 70, 3000},
+            set(range(100, 200)) | set(range(300, 400)),
+            set(range(1, size, 3)),
+        ):
+            segment = indexmap.Segment(2, values=values)
+            expected = sorted(size * 2 + n for n in values)
+            step = max(len(expected) // 7, 1)
+            for index in range(0, len(expected), step):
+                number = expected[index]
+                self.assertEqual(segment.select(index), number)
+                self.assertEqual(segment.rank(number), index)
+                self.assertEqual(segment.rank(number + 1), index + 1)
+            self.assertEqual(segment.select(-1), expected[-1])
+            self.assertEqual(segment.rank(0), 0)
+            self.assertEqual(segment.rank(size * 3), len(expected))
+            self.assertRaisesRegex(
+                IndexError,
+                "Segment index out of range$",
+                segment.select,
+                *(len(expected),),
+            )
+
+    def test_017_rank_select_002(self):
+        segment = indexmap.Segment(0, values=range(0, 30000, 2))
+        self.assertEqual(segment.select(100), 200)
+        segment.add_record_number(1)
+        self.assertEqual(segment.select(100), 198)
+        self.assertEqual(segment.rank(200), 101)
+        segment.remove_many(range(0, 100))
+        self.assertEqual(segment.select(100), 300)
+
+    def test_018_numpy_001(self):
+        rng = random.Random(18)
+        size = indexmap.SEGMENTSIZE
+        samples = [
+            set(rng.sample(range(size), count))
+            for count in (1, 300, 3000, 40000, size)
+        ]
+        answers = []
+        installed = indexmap.numpy
+        try:
+            for numpy in installed, None:
+                indexmap.numpy = numpy
+                answer = []
+                for values in samples:
+                    segment = indexmap.Segment(0, values=values)
+                    segment.convert_to_bitmap()
+                    answer.append(segment.values)
+                    answer.append(segment.get_record_numbers())
+                    answer.append(segment.select(len(values) // 2))
+                    segment.convert_to_set()
+                    answer.append(segment.values)
+                answers.append(answer)
+        finally:
+            indexmap.numpy = installed
+        self.assertEqual(answers[0], answers[1])
+
+    def test_018_numpy_002(self):
+        root = os.path.dirname(
+            os.path.dirname(
+                os.path.dirname(os.path.abspath(indexmap.__file__))
+            )
+        )
+        code = "".join(
+            (
+                "import sys\n",
+                "from solentware_misc.core import indexmap\n",
+                "print('numpy' in sys.modules)\n",
+                "indexmap.Segment(0, values=range(0, 65280, 2))\n",
+                "print(indexmap.numpy is sys.modules.get('numpy'))\n",
+            )
+        )
+        result = subprocess.run(
+            (sys.executable, "-c", code),
+            cwd=root,
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+        self.assertEqual(result.stdout.split(), ["False", "True"])
+
+    def test_019_segment_class_001(self):
+        geometry = indexmap.segment_class(1024, 64)
+        self.assertIs(indexmap.segment_class(1024, 64), geometry)
+        self.assertIs(indexmap.segment_class(), indexmap.Segment)
+        self.assertEqual(geometry.SEGMENTSIZE, 65536)
+        self.assertEqual(geometry.SEGMENTSHIFT, 16)
+        self.assertEqual(indexmap.Segment.SEGMENTSHIFT, None)
+        self.assertEqual(geometry.locate(65536 * 3 + 7), (3, 7))
+        self.assertEqual(
+            indexmap.Segment.locate(indexmap.SEGMENTSIZE * 3 + 7), (3, 7)
+        )
+        segment = geometry(1)
+        segment.add_many(range(65536 - 10, 65536 * 2 + 10, 3))
+        numbers = list(range(65536 - 10, 65536 * 2 + 10, 3))
+        numbers = [n for n in numbers if 65536 <= n < 65536 * 2]
+        self.assertEqual(segment.get_record_numbers(), numbers)
+        self.assertEqual(segment.select(-1), numbers[-1])
+        self.assertEqual(segment.rank(numbers[-1]), len(segment) - 1)
+        other = geometry(1, values=range(5000))
+        self.assertEqual(len(segment & other), len(range(2, 5000, 3)))
+
+    def test_019_segment_class_002(self):
+        self.assertRaisesRegex(
+            ValueError,
+            "".join(
+                (
+                    "Segment geometry needs mapsize at least 1 and ",
+                    "integersize a positive multiple of 8$",
+                )
+            ),
+            indexmap.segment_class,
+            *(1024, 12),
+        )
+        self.assertRaisesRegex(
+            ValueError,
+            "Segment of size 65536 cannot be combined with segment of size ",
+            operator.and_,
+            *(indexmap.segment_class(1024, 64)(0), indexmap.Segment(0)),
+        )
+
+    def test_019_segment_class_003(self):
+        installed = indexmap.numpy
+        try:
+            for numpy in installed, None:
+                indexmap.numpy = numpy
+                for integersize in (24, 128):
+                    values = range(3, 100 * integersize, 5)
+                    segment = indexmap.segment_class(100, integersize)(
+                        0, values=values
+                    )
+                    self.assertIsInstance(segment.values, bytearray)
+                    self.assertEqual(segment.rank(100), 20)
+                    self.assertEqual(segment.rank(values[-1] + 1), len(values))
+                    self.assertEqual(segment.select(20), 103)
+                    self.assertEqual(segment.select(-1), values[-1])
+        finally:
+            indexmap.numpy = installed
+
+    def test_020_delta_001(self):
+        segment = indexmap.Segment(0, values=range(0, 5000, 3))
+        self.assertEqual(segment.dirty_words(), None)
+        self.assertRaisesRegex(
+            ValueError,
+            "Segment changes are not tracked until mark_saved",
+            segment.delta,
+        )
+        segment.mark_saved()
+        self.assertEqual(segment.dirty_words(), [])
+        segment.add_record_number(1)
+        segment.remove_record_number(3)
+        self.assertEqual(segment.dirty_words(), [0])
+        self.assertEqual(
+            indexmap.decode_delta(segment.delta()),
+            (indexmap.FORMATDELTALIST, ([1], [3])),
+        )
+        segment.add_record_number(3)
+        segment.remove_record_number(1)
+        self.assertEqual(segment.dirty_words(), [])
+
+    def test_020_delta_002(self):
+        saved = indexmap.Segment(1, pickled=indexmap.Segment(1).pickle_map())
+        segment = saved.copy()
+        base = indexmap.SEGMENTSIZE
+        segment.add_many(range(base + 40, base + 4000))
+        segment |= indexmap.Segment(1, values=[70000 - base])
+        self.assertEqual(segment.dirty_words(), list(range(1, 125)) + [147])
+        data = segment.delta()
+        self.assertEqual(data[:2], bytes((1, indexmap.FORMATDELTAWORDS)))
+        self.assertEqual(
+            indexmap.decode_delta(data)[1][:2],
+            [(1, 0xFFFFFF00), (2, 0xFFFFFFFF)],
+        )
+        saved.apply_delta(data)
+        self.assertEqual(
+            saved.get_record_numbers(), segment.get_record_numbers()
+        )
+        self.assertEqual(len(saved), len(segment))
+
+    def test_020_delta_003(self):
+        segment = indexmap.Segment.from_bytes(
+            2, indexmap.Segment(2, values=[5, 6]).to_bytes()
+        )
+        self.assertEqual(segment.dirty_words(), [])
+        self.assertEqual(segment._changed, bytearray())
+        self.assertEqual(segment.copy()._changed, bytearray())
+        segment.add_record_number(2 * indexmap.SEGMENTSIZE + 9)
+        self.assertEqual(len(segment._changed), indexmap.SEGMENTSIZE // 8)
+        self.assertEqual(segment.dirty_words(), [0])
+        self.assertEqual(
+            indexmap.decode_delta(segment.delta()),
+            (indexmap.FORMATDELTALIST, ([9], [])),
+        )
+        self.assertRaisesRegex(
+            ValueError,
+            "Segment delta kind 9 is not supported$",
+            indexmap.decode_delta,
+            *(b"\x01\x09",),
+        )
+
+
+class ConcurrentSegment(unittest.TestCase):
+    def setUp(self):
+        pass
+
+    def tearDown(self):
+        pass
+
+    def test_001_update_001(self):
+        concurrent = indexmap.ConcurrentSegment(0, values=[1, 2])
+        before = concurrent.snapshot()
+        concurrent.add_record_number(3)
+        concurrent.remove_record_number(1)
+        concurrent.add_many(range(100, 200, 2))
+        concurrent.remove_many([100, 102])
+        self.assertEqual(concurrent.version, 4)
+        self.assertEqual(before.get_record_numbers(), [1, 2])
+        self.assertEqual(
+            concurrent.get_record_numbers(), [2, 3] + list(range(104, 200, 2))
+        )
+        self.assertEqual(len(concurrent), 50)
+        self.assertIn(3, concurrent)
+        self.assertNotIn(1, concurrent)
+
+    def test_001_update_002(self):
+        concurrent = indexmap.ConcurrentSegment(0, values=[1])
+        snapshot = concurrent.snapshot()
+
+        def fail(segment):
+            segment.add_record_number(2)
+            raise RuntimeError
+
+        self.assertRaises(RuntimeError, concurrent.update, fail)
+        self.assertIs(concurrent.snapshot(), snapshot)
+        self.assertEqual(concurrent.version, 0)
+
+    def test_002_threads_001(self):
+        concurrent = indexmap.ConcurrentSegment(0)
+        size = indexmap.SEGMENTSIZE
+
+        def write(start):
+            for number in range(start, size, 4):
+                concurrent.add_record_number(number)
+                if not number % 100:
+                    concurrent.add_many(range(start, number, 4))
+
+        writers = [
+            threading.Thread(target=write, args=(start,)) for start in range(4)
+        ]
+        for writer in writers:
+            writer.start()
+        counts = []
+        while any(writer.is_alive() for writer in writers):
+            snapshot = concurrent.snapshot()
+            self.assertEqual(len(snapshot.get_record_numbers()), len(snapshot))
+            counts.append(len(snapshot))
+        for writer in writers:
+            writer.join()
+        self.assertEqual(counts, sorted(counts))
+        self.assertEqual(concurrent.get_record_numbers(), list(range(size)))
+
+
+class RecordSet(unittest.TestCase):
+    def setUp(self):
+        pass
+
+    def tearDown(self):
+        pass
+
+    def test_001_add_001(self):
+        size = indexmap.SEGMENTSIZE
+        numbers = [5 * size + 3, 7, size * 2, 1, 5 * size + 2]
+        recordset = indexmap.RecordSet(numbers)
+        self.assertEqual(sorted(recordset.segments), [0, 2, 5])
+        self.assertEqual(len(recordset), 5)
+        self.assertEqual(list(recordset), sorted(numbers))
+        self.assertIn(size * 2, recordset)
+        self.assertNotIn(size * 2 + 1, recordset)
+        self.assertNotIn(size * 9, recordset)
+
+    def test_002_remove_001(self):
+        size = indexmap.SEGMENTSIZE
+        recordset = indexmap.RecordSet([1, size + 1, size + 2])
+        recordset.remove(1)
+        self.assertEqual(sorted(recordset.segments), [1])
+        recordset.discard(1)
+        self.assertRaisesRegex(KeyError, "1", recordset.remove, *(1,))
+        recordset.remove(size + 2)
+        self.assertEqual(recordset.get_record_numbers(), [size + 1])
+
+    def test_003_set_algebra_001(self):
+        rng = random.Random(3)
+        left = set(rng.sample(range(indexmap.SEGMENTSIZE * 6), 50000))
+        right = set(rng.sample(range(indexmap.SEGMENTSIZE * 3, 10**6), 500))
+        for function, inplace in (
+            (operator.and_, operator.iand),
+            (operator.or_, operator.ior),
+            (operator.xor, operator.ixor),
+            (operator.sub, operator.isub),
+        ):
+            lrs = indexmap.RecordSet(left)
+            rrs = indexmap.RecordSet(right)
+            expected = sorted(function(left, right))
+            self.assertEqual(list(function(lrs, rrs)), expected)
+            self.assertEqual(list(lrs), sorted(left))
+            self.assertIs(inplace(lrs, rrs), lrs)
+            self.assertEqual(list(lrs), expected)
+            self.assertEqual(list(rrs), sorted(right))
+
+    def test_004_add_many_001(self):
+        size = indexmap.SEGMENTSIZE
+        recordset = indexmap.RecordSet()
+        recordset.add_many(range(size * 3 + 5, size - 5, -size // 2))
+        recordset.add_many([1, size * 7])
+        recordset.remove_many(array("I", [1, 2, size * 3 + 5]))
+        self.assertEqual(sorted(recordset.segments), [1, 2, 7])
+        self.assertEqual(
+            list(recordset),
+            list(range(size + 5, size * 3 + 5, size // 2)) + [size * 7],
+        )
+
+    def test_005_iter_record_numbers_001(self):
+        size = indexmap.SEGMENTSIZE
+        numbers = [3, size + 4, size + 9, size * 4 + 1]
+        recordset = indexmap.RecordSet(numbers)
+        self.assertEqual(
+            list(recordset.iter_record_numbers(start=size + 5)), numbers[2:]
+        )
+        self.assertEqual(
+            list(recordset.iter_record_numbers(start=size * 3, reverse=True)),
+            numbers[2::-1],
+        )
+
+    def test_006_rank_select_001(self):
+        size = indexmap.SEGMENTSIZE
+        numbers = [3, size + 4, size + 9, size * 4 + 1]
+        recordset = indexmap.RecordSet(numbers)
+        for index, number in enumerate(numbers):
+            self.assertEqual(recordset.select(index), number)
+            self.assertEqual(recordset.rank(number), index)
+        self.assertEqual(recordset.select(-1), numbers[-1])
+        self.assertEqual(recordset.rank(size * 2), 3)
+        self.assertRaisesRegex(
+            IndexError,
+            "RecordSet index out of range$",
+            recordset.select,
+            *(4,),
+        )
+
+    def test_007_segment_class_001(self):
+        geometry = indexmap.segment_class(1024, 64)
+
+        class RecordSet(indexmap.RecordSet):
+            segment_class = geometry
+
+        numbers = [3, 65536 + 4, 65536 * 4 + 1]
+        recordset = RecordSet(numbers)
+        self.assertEqual(sorted(recordset.segments), [0, 1, 4])
+        self.assertEqual(list(recordset), numbers)
+        self.assertEqual(recordset.select(1), numbers[1])
+
 
 if __name__ == "__main__":
     runner = unittest.TextTestRunner
     loader = unittest.defaultTestLoader.loadTestsFromTestCase
     runner().run(loader(Segment))
+    runner().run(loader(ConcurrentSegment))
+    runner().run(loader(RecordSet))
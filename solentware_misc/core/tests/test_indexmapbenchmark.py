@@ -0,0 +1,67 @@
+# test_indexmapbenchmark.py
+# Copyright 2026 Roger Marsh
+# Licence: See LICENCE (BSD licence)
+
+"""indexmapbenchmark tests"""
+
+import unittest
+
+from .. import indexmapbenchmark
+from .. import indexmap
+
+
+class IndexmapBenchmark(unittest.TestCase):
+    def setUp(self):
+        pass
+
+    def tearDown(self):
+        pass
+
+    def test_001_workload_offsets_001(self):
+        size = indexmap.SEGMENTSIZE
+        for workload in indexmapbenchmark.WORKLOADS:
+            offsets = indexmapbenchmark.workload_offsets(workload, 0.1)
+            self.assertEqual(len(offsets), int(size * 0.1))
+            self.assertEqual(offsets, sorted(set(offsets)))
+            self.assertLess(offsets[-1], size)
+
+    def test_001_workload_offsets_002(self):
+        self.assertRaisesRegex(
+            ValueError,
+            "Workload 'x' not known$",
+            indexmapbenchmark.workload_offsets,
+            *("x", 0.1),
+        )
+
+    def test_002_run_001(self):
+        results = list(
+            indexmapbenchmark.run(
+                workloads=("random",), densities=(0.01,), repeat=1
+            )
+        )
+        self.assertEqual(results[0]["benchmark"], "indexmap")
+        self.assertEqual(results[0]["mapsize"], indexmap.MAPSIZE)
+        self.assertEqual(
+            [result["operation"] for result in results[1:]],
+            [
+                "add_record_number",
+                "add_many",
+                "remove_record_number",
+                "convert_to_bitmap",
+                "convert_to_set",
+                "get_record_numbers",
+                "pickle_map",
+                "unpickle",
+                "to_bytes",
+                "from_bytes",
+            ],
+        )
+        for result in results[1:]:
+            self.assertEqual(result["workload"], "random")
+            self.assertGreaterEqual(result["seconds"], 0)
+
+
+if __name__ == "__main__":
+    runner = unittest.TextTestRunner
+    loader = unittest.defaultTestLoader.loadTestsFromTestCase
+    runner().run(loader(IndexmapBenchmark))
@@ -0,0 +1,94 @@
+# test_processqueue.py
+# Copyright 2026 Roger Marsh
+# Licence: See LICENCE (BSD licence)
+
+"""processqueue tests"""
+
+import unittest
+import os
+import threading
+import time
+
+from .. import processqueue
+
+
+def process_id(logwidget=None):
+    """Log and return the process id of the process running this function."""
+    logwidget.append_text("Running")
+    logwidget.append_text_only(str(os.getpid()))
+    return os.getpid()
+
+
+class Log:
+    """Record log entries appended by a ProcessLog."""
+
+    def __init__(self, expected):
+        self.entries = []
+        self.expected = expected
+        self.done = threading.Event()
+
+    def append_text(self, text, timestamp=True):
+        self.entries.append((text, timestamp))
+        if len(self.entries) == self.expected:
+            self.done.set()
+
+
+class ProcessCallQueue(unittest.TestCase):
+    def setUp(self):
+        self.threads = threading.active_count()
+        self.processqueue = processqueue.ProcessCallQueue(workers=2)
+
+    def tearDown(self):
+        self.assertEqual(self.processqueue.shutdown(timeout=60), True)
+        self.assertEqual(threading.active_count(), self.threads)
+
+    def test_001_put_method_001(self):
+        future = self.processqueue.put_method(pow, args=(2, 10))
+        self.assertEqual(future.result(timeout=60), 1024)
+
+    def test_001_put_method_002(self):
+        future = self.processqueue.put_method(int, args=("x",))
+        self.assertIsInstance(future.exception(timeout=60), ValueError)
+
+    def test_001_put_method_003(self):
+        log = Log(2)
+        future = self.processqueue.put_method(
+            process_id, kwargs=dict(logwidget=log)
+        )
+        pid = future.result(timeout=60)
+        self.assertNotEqual(pid, os.getpid())
+        self.assertEqual(log.done.wait(60), True)
+        self.assertEqual(log.entries, [("Running", True), (str(pid), False)])
+        self.assertEqual(self.processqueue.shutdown(timeout=60), True)
+        self.assertEqual(self.processqueue._log_widgets, {})
+
+    def test_001_put_method_004(self):
+        log = Log(4)
+        running = [
+            self.processqueue.put_method(time.sleep, args=(1,))
+            for _ in range(2)
+        ]
+        queued = self.processqueue.put_method(
+            process_id, kwargs=dict(logwidget=log)
+        )
+        self.assertEqual(queued.cancel(), True)
+        self.assertEqual(self.processqueue._log_widgets, {})
+        futures = [
+            self.processqueue.put_method(
+                process_id, kwargs=dict(logwidget=log)
+            )
+            for _ in range(2)
+        ]
+        self.assertEqual(len(self.processqueue._log_widgets), 1)
+        self.assertEqual(self.processqueue.shutdown(timeout=60), True)
+        self.assertEqual(log.done.wait(60), True)
+        self.assertEqual(self.processqueue._log_widgets, {})
+        self.assertEqual(
+            [f.exception() for f in running + futures], [None] * 4
+        )
+
+
+if __name__ == "__main__":
+    runner = unittest.TextTestRunner
+    loader = unittest.defaultTestLoader.loadTestsFromTestCase
+    runner().run(loader(ProcessCallQueue))
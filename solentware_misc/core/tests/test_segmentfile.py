@@ -0,0 +1,121 @@
+# test_segmentfile.py
+# Copyright 2026 Roger Marsh
+# Licence: See LICENCE (BSD licence)
+
+"""segmentfile tests"""
+
+import unittest
+import os
+import tempfile
+
+from .. import segmentfile
+from .. import indexmap
+
+
+class SegmentFile(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "segments")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_001___init___001(self):
+        with segmentfile.SegmentFile(self.path) as segments:
+            self.assertEqual(len(segments), 0)
+            self.assertEqual(segments.page_view(0), None)
+            self.assertEqual(len(segments.get_segment(3)), 0)
+        self.assertEqual(os.path.getsize(self.path), 0)
+
+    def test_002_put_segment_001(self):
+        size = indexmap.SEGMENTSIZE
+        sparse = indexmap.Segment(3, values=[1, 9])
+        dense = indexmap.Segment(1, values=range(0, size, 2))
+        with segmentfile.SegmentFile(self.path) as segments:
+            segments.put_segment(sparse)
+            segments.put_segment(dense)
+            self.assertEqual(len(segments), 4)
+            self.assertEqual(len(segments.get_segment(0)), 0)
+        self.assertEqual(os.path.getsize(self.path), segmentfile.PAGESIZE * 4)
+        with segmentfile.SegmentFile(self.path) as segments:
+            for segment in sparse, dense:
+                self.assertEqual(
+                    segments.get_segment(segment.segment).get_record_numbers(),
+                    segment.get_record_numbers(),
+                )
+            sparse.add_record_number(size * 3 + 2)
+            segments.put_segment(sparse)
+            segments.flush()
+            self.assertEqual(
+                segments.get_segment(3).get_record_numbers(),
+                [size * 3 + 1, size * 3 + 2, size * 3 + 9],
+            )
+
+    def test_003_page_view_001(self):
+        segment = indexmap.Segment(0, values=[0, 9])
+        with segmentfile.SegmentFile(self.path) as segments:
+            segments.put_segment(segment)
+            with segments.page_view(0) as view:
+                self.assertEqual(len(view), segmentfile.BITMAPSIZE)
+                self.assertEqual(bytes(view[:2]), b"\x01\x02")
+
+    def test_004_segment_class_001(self):
+        geometry = indexmap.segment_class(2048, 64)
+        segment = geometry(2, values=range(0, geometry.SEGMENTSIZE, 5))
+        with segmentfile.SegmentFile(self.path, segment_class=geometry) as sf:
+            self.assertEqual(sf.pagesize, geometry.SEGMENTSIZE // 8)
+            sf.put_segment(segment)
+            copy = sf.get_segment(2)
+            self.assertIsInstance(copy, geometry)
+            self.assertEqual(
+                copy.get_record_numbers(), segment.get_record_numbers()
+            )
+
+    def test_004_segment_class_002(self):
+        self.assertRaisesRegex(
+            ValueError,
+            "Page size 4096 is too small for bitmap of 8160 bytes$",
+            segmentfile.SegmentFile,
+            *(self.path,),
+            **dict(pagesize=4096),
+        )
+
+    def test_005_put_changes_001(self):
+        size = indexmap.SEGMENTSIZE
+        with segmentfile.SegmentFile(self.path) as segments:
+            segment = indexmap.Segment(1, values=range(0, size, 2))
+            segments.put_segment(segment)
+            self.assertEqual(segment.dirty_words(), [])
+            segment.remove_record_number(size + 2)
+            segment.add_record_number(size + 99)
+            segments.put_changes(segment)
+            self.assertEqual(segment.dirty_words(), [])
+            segment = segments.get_segment(1)
+            segment.add_many(range(size + 1, size + 200, 2))
+            segments.put_changes(segment)
+            segment.remove_many(range(size * 2 - 10, size * 2))
+            segments.put_changes(segment)
+            self.assertEqual(
+                segments.get_segment(1).get_record_numbers(),
+                segment.get_record_numbers(),
+            )
+
+    def test_005_put_changes_002(self):
+        size = indexmap.SEGMENTSIZE
+        with segmentfile.SegmentFile(self.path) as segments:
+            segments.put_segment(indexmap.Segment(0, values=[1]))
+            segment = segments.get_segment(3)
+            self.assertEqual(len(segment), 0)
+            self.assertEqual(segment.dirty_words(), [])
+            segment.add_record_number(size * 3 + 5)
+            segments.put_changes(segment)
+            self.assertEqual(len(segments), 4)
+            self.assertEqual(
+                segments.get_segment(3).get_record_numbers(), [size * 3 + 5]
+            )
+
+
+if __name__ == "__main__":
+    runner = unittest.TextTestRunner
+    loader = unittest.defaultTestLoader.loadTestsFromTestCase
+    runner().run(loader(SegmentFile))
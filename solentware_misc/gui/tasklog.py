@@ -15,9 +15,16 @@ import threading
 
 from solentware_bind.gui.bindings import Bindings
 
+from ..core import callthreadqueue
+from ..core import processqueue
 from .logtextbase import LogTextBase
 
 
+def _raise_exception(exception):
+    """Raise exception so it is reported by a try_command wrapper."""
+    raise exception
+
+
 class TaskLog(Bindings):
     """Run function in separate thread and provide progress report log."""
 
@@ -45,6 +52,8 @@ class TaskLog(Bindings):
         self._cancelmethod = cancelmethod
         self.logwidget = logwidget
         self.report = logwidget
+        self._token = None
+        self._futures = []
 
     def _create_log_widget(self):
         """Create the log widget, usually after scheduling the task."""
@@ -107,20 +116,144 @@ class TaskLog(Bindings):
         self.report.append_text(text, timestamp=False)
 
     def do_cancel(self):
-        """Cancel button action."""
+        """Cancel button action.
+
+        Queued tasks are cancelled and running tasks given a token are asked
+        to stop.  The log is closed when no tasks are queued or running.
+
+        """
         if self._threadqueue.queue.unfinished_tasks == 0:
             if callable(self._cancelmethod):
                 self._cancelmethod()
             self.logwidget.destroy()
+            return
+        for future in self._futures:
+            future.cancel()
+        self._futures = [f for f in self._futures if not f.done()]
+        if self._token is not None and not self._token.cancelled:
+            self._token.cancel()
+            self.report.append_text(
+                "".join(
+                    (
+                        "Cancel requested.  The task will stop at it's ",
+                        "next checkpoint.",
+                    )
+                )
+            )
+
+    def get_token(self):
+        """Return the TaskToken given to tasks run with with_token True.
+
+        A new token is created if the current one has been cancelled.
+
+        """
+        if self._token is None or self._token.cancelled:
+            self._token = callthreadqueue.TaskToken(
+                reporter=self._report_progress
+            )
+        return self._token
+
+    def _log_cancellation(self, method):
+        """Return method wrapped to log, rather than raise, TaskCancelled.
+
+        method - the task method, which may be given a TaskToken.
+
+        TaskCancelled is caught before the try_command wrapper would report
+        it as an unexpected exception.
+        """
+
+        def run_until_cancelled(*args, **kwargs):
+            try:
+                return method(*args, **kwargs)
+            except callthreadqueue.TaskCancelled:
+                self.report.append_text("Task cancelled")
+                return None
 
-    def run_method(self, method, message=None, args=(), kwargs=None):
+        return run_until_cancelled
+
+    def _report_exception(self, future):
+        """Append exception raised by task run in another process to log."""
+        if future.cancelled():
+            return
+        exception = future.exception()
+        if exception is not None:
+            self.report.append_text(
+                "".join(("Task failed: ", repr(exception)))
+            )
+
+    def _report_outcome(self, future):
+        """Log cancellation, or report failure, of task run in a thread.
+
+        The task's exception is set on future, so the queue's metrics record
+        the task as cancelled or failed, and a failure is reported by the
+        try_command wrapper in the main thread.
+        """
+        if future.cancelled():
+            return
+        exception = future.exception()
+        if exception is None:
+            return
+        if isinstance(exception, callthreadqueue.TaskCancelled):
+            self.report.append_text("Task cancelled")
+            return
+        report = self.try_command(_raise_exception, self.logwidget)
+        if threading.current_thread().name == "MainThread":
+            report(exception)
+        else:
+            self.get_app().get_reportqueue().put((report, (exception,), {}))
+
+    def _report_progress(self, fraction, message):
+        """Append progress report from a task to the log."""
+        text = "".join((str(int(fraction * 100)), "% done"))
+        if message:
+            text = "".join((text, ": ", message))
+        self.report.append_text(text)
+
+    def run_method(
+        self,
+        method,
+        message=None,
+        args=(),
+        kwargs=None,
+        priority=0,
+        key=None,
+        with_token=False,
+    ):
         """Add the task method to queue for processing in separate thread.
 
         method - method to be run in separate thread.
         message - log entry if method is placed on queue for running.
         args - positional arguments for method.
         kwargs - keyword arguments for method, default {}.
+        priority - tasks with lower values are run first, default 0.
+        key - task replaces a queued task with the same key, default None.
+        with_token - if True the TaskToken from get_token() is passed to
+        method as the token keyword argument, so the Cancel button can stop
+        it and it can report progress.
+
+        A task stopped by it's TaskToken is logged as cancelled.  Other
+        exceptions raised by method are reported in the main thread.
+
+        If the application's thread queue is a ProcessCallQueue the method
+        and arguments must be picklable, so ValueError is raised if
+        with_token is True, and an exception raised by method is appended to
+        the log.
+
+        The TaskFuture for method is returned if it is placed on the queue,
+        otherwise None.  The method is not placed on the queue, and the
+        rejection is recorded in the queue's metrics, if the queue is full.
         """
+        if with_token and isinstance(
+            self._threadqueue, processqueue.ProcessCallQueue
+        ):
+            raise ValueError(
+                "".join(
+                    (
+                        "A TaskToken cannot be given to a task run by a ",
+                        "ProcessCallQueue",
+                    )
+                )
+            )
         self._create_log_widget()
         if not callable(method):
             self.report.append_text(
@@ -135,12 +268,31 @@ class TaskLog(Bindings):
             if kwargs is None:
                 kwargs = {}
             kwargs["logwidget"] = self.report
+            if with_token:
+                kwargs["token"] = self.get_token()
+            in_process = isinstance(
+                self._threadqueue, processqueue.ProcessCallQueue
+            )
+            name = getattr(method, "__qualname__", repr(method))
             try:
-                self._threadqueue.put_method(
-                    self.try_command(method, self.logwidget), args, kwargs
+                future = self._threadqueue.put_method(
+                    method,
+                    args,
+                    kwargs,
+                    priority=priority,
+                    key=key,
+                    block=False,
+                    name=name,
                 )
+                if in_process:
+                    future.add_done_callback(self._report_exception)
+                else:
+                    future.add_done_callback(self._report_outcome)
+                self._futures = [f for f in self._futures if not f.done()]
+                self._futures.append(future)
                 if isinstance(message, str):
                     self.report.append_text(message)
+                return future
             except queue.Full:
                 self.report.append_text(
                     "Application busy.  Please try again shortly."
@@ -156,7 +308,12 @@ class TaskLog(Bindings):
             )
             if kwargs is None:
                 kwargs = {}
-            self.try_command(method, self.logwidget)(*args, **kwargs)
+            if with_token:
+                kwargs["token"] = self.get_token()
+            self.try_command(self._log_cancellation(method), self.logwidget)(
+                *args, **kwargs
+            )
+        return None
 
 
 class LogText(LogTextBase):
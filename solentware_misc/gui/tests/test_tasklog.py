@@ -0,0 +1,109 @@
+# test_tasklog.py
+# Copyright 2026 Roger Marsh
+# Licence: See LICENCE (BSD licence)
+
+"""tasklog tests"""
+
+import unittest
+import queue
+import threading
+import time
+
+from ...core import callthreadqueue
+from .. import tasklog
+
+
+class Log:
+    """Record log entries appended by TaskLog and it's tasks."""
+
+    def __init__(self):
+        self.entries = []
+
+    def append_text(self, text, timestamp=True):
+        self.entries.append(text)
+
+    def winfo_toplevel(self):
+        return self
+
+
+class Application:
+    """Provide the thread and report queues used by TaskLog."""
+
+    def __init__(self, threadqueue):
+        self.threadqueue = threadqueue
+        self.reportqueue = queue.Queue()
+
+    def get_thread_queue(self):
+        return self.threadqueue
+
+    def get_reportqueue(self):
+        return self.reportqueue
+
+
+def wait_for_cancel(started, logwidget=None, token=None):
+    """Run until token is cancelled."""
+    started.set()
+    while True:
+        token.check()
+        time.sleep(0.01)
+
+
+def fail(logwidget=None):
+    """Raise ValueError."""
+    raise ValueError("Task failed")
+
+
+class TaskLog(unittest.TestCase):
+    def setUp(self):
+        self.threads = threading.active_count()
+        self.threadqueue = callthreadqueue.CallThreadQueue()
+        self.log = Log()
+        self.application = Application(self.threadqueue)
+        self.tasklog = tasklog.TaskLog(
+            get_app=lambda: self.application,
+            logwidget=self.log,
+        )
+        self.reported = []
+        self.tasklog.report_exception = lambda **kwargs: self.reported.append(
+            kwargs
+        )
+
+    def tearDown(self):
+        self.assertEqual(self.threadqueue.shutdown(timeout=60), True)
+        self.assertEqual(threading.active_count(), self.threads)
+
+    def test_001_run_method_001(self):
+        started = threading.Event()
+        future = self.tasklog.run_method(
+            wait_for_cancel, args=(started,), with_token=True
+        )
+        self.assertEqual(started.wait(60), True)
+        self.tasklog.do_cancel()
+        self.assertIsInstance(
+            future.exception(timeout=60), callthreadqueue.TaskCancelled
+        )
+        self.assertEqual(self.threadqueue.shutdown(timeout=60), True)
+        self.assertEqual(self.log.entries[-1], "Task cancelled")
+        self.assertEqual(self.reported, [])
+        self.assertEqual(
+            self.threadqueue.stats()["outcomes"],
+            {callthreadqueue.CANCELLED: 1},
+        )
+
+    def test_001_run_method_002(self):
+        future = self.tasklog.run_method(fail)
+        self.assertIsInstance(future.exception(timeout=60), ValueError)
+        self.assertEqual(self.threadqueue.shutdown(timeout=60), True)
+        self.assertEqual(self.reported, [])
+        method, args, kwargs = self.application.reportqueue.get_nowait()
+        method(*args, **kwargs)
+        self.assertEqual(len(self.reported), 1)
+        self.assertEqual(
+            self.threadqueue.stats()["outcomes"], {callthreadqueue.FAILED: 1}
+        )
+
+
+if __name__ == "__main__":
+    runner = unittest.TextTestRunner
+    loader = unittest.defaultTestLoader.loadTestsFromTestCase
+    runner().run(loader(TaskLog))
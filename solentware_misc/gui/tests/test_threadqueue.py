@@ -0,0 +1,200 @@
+# test_threadqueue.py
+# Copyright 2026 Roger Marsh
+# Licence: See LICENCE (BSD licence)
+
+"""threadqueue tests"""
+
+import unittest
+import os
+import queue
+import threading
+import time
+
+from .. import threadqueue
+
+
+class ReportQueue(unittest.TestCase):
+    def setUp(self):
+        pass
+
+    def tearDown(self):
+        pass
+
+    def do_all(self, reportqueue):
+        while True:
+            try:
+                method, args, kwargs = reportqueue.get_nowait()
+            except queue.Empty:
+                break
+            method(*args, **kwargs)
+            reportqueue.task_done()
+
+    def test_001___init___001(self):
+        self.assertRaisesRegex(
+            ValueError,
+            "ReportQueue policy 'x' is not supported$",
+            threadqueue.ReportQueue,
+            **dict(policy="x"),
+        )
+
+    def test_002_put_001(self):
+        reportqueue = threadqueue.ReportQueue(
+            maxsize=2, policy=threadqueue.BLOCK
+        )
+        log = []
+        reportqueue.put((log.append, ("a",), {}))
+        reportqueue.put((log.append, ("b",), {}))
+        self.assertRaises(
+            queue.Full,
+            reportqueue.put,
+            *((log.append, ("c",), {}),),
+            **dict(block=False),
+        )
+        self.do_all(reportqueue)
+        self.assertEqual(log, ["a", "b"])
+
+    def test_002_put_002(self):
+        reportqueue = threadqueue.ReportQueue(
+            maxsize=2, policy=threadqueue.DROP_OLDEST
+        )
+        log = []
+        for text in "abcd":
+            reportqueue.put((log.append, (text,), {}), block=False)
+        self.assertEqual(reportqueue.dropped, 2)
+        self.assertEqual(reportqueue.unfinished_tasks, 2)
+        self.do_all(reportqueue)
+        self.assertEqual(log, ["c", "d"])
+        reportqueue.join()
+
+    def test_002_put_003(self):
+        reportqueue = threadqueue.ReportQueue(
+            maxsize=2, policy=threadqueue.COALESCE
+        )
+        log = []
+        other = []
+        for text in "abc":
+            reportqueue.put((log.append, (text,), {}), block=False)
+        reportqueue.put((other.extend, ("xy",), {}), block=False)
+        self.assertEqual(reportqueue.qsize(), 2)
+        self.assertRaises(
+            queue.Full,
+            reportqueue.put,
+            *((log.append, ("d",), {}),),
+            **dict(block=False),
+        )
+        reportqueue.put((other.extend, ("z",), {}), block=False)
+        self.do_all(reportqueue)
+        self.assertEqual(log, ["a", "b", "c"])
+        self.assertEqual(other, ["x", "y", "z"])
+        reportqueue.join()
+
+    def test_002_put_004(self):
+        reportqueue = threadqueue.ReportQueue()
+        read_fd, write_fd = os.pipe()
+        reportqueue.wakeup_fd = write_fd
+        try:
+            thread = threading.Thread(
+                target=reportqueue.put, args=((print, (), {}),)
+            )
+            thread.start()
+            thread.join()
+            self.assertEqual(os.read(read_fd, 10), b"\0")
+        finally:
+            os.close(read_fd)
+            os.close(write_fd)
+
+    def test_002_put_005(self):
+        reportqueue = threadqueue.ReportQueue(
+            maxsize=3, policy=threadqueue.COALESCE, coalescelimit=100
+        )
+        log = []
+        for number in range(300):
+            reportqueue.put((log.append, (number,), {}), block=False)
+        self.assertEqual(reportqueue.qsize(), 3)
+        self.assertEqual(
+            [len(entry[1][1]) for entry in reportqueue.queue], [100] * 3
+        )
+        self.assertRaises(
+            queue.Full,
+            reportqueue.put,
+            *((log.append, (300,), {}),),
+            **dict(block=False),
+        )
+        self.do_all(reportqueue)
+        self.assertEqual(log, list(range(300)))
+        reportqueue.join()
+
+    def test_003_run_entries_001(self):
+        reportqueue = threadqueue.ReportQueue(
+            maxsize=4, policy=threadqueue.COALESCE, coalescelimit=100
+        )
+        log = []
+        for number in range(250):
+            reportqueue.put((log.append, (number,), {}), block=False)
+        reportqueue.put((log.extend, ("ab",), {}), block=False)
+
+        # No time allowed so one call is done each time, and the rest of a
+        # coalesced entry is kept for the next time.
+        self.assertEqual(reportqueue.run_entries(0), 1)
+        self.assertEqual(log, [0])
+        self.assertEqual(reportqueue.qsize(), 3)
+        self.assertEqual(reportqueue.unfinished_tasks, 4)
+        for number in range(1, 200):
+            self.assertEqual(reportqueue.run_entries(0), 1)
+        self.assertEqual(log, list(range(200)))
+        self.assertEqual(reportqueue.qsize(), 2)
+        self.assertEqual(reportqueue.unfinished_tasks, 2)
+        self.assertEqual(reportqueue.run_entries(60), 51)
+        self.assertEqual(log, list(range(250)) + ["a", "b"])
+        self.assertEqual(reportqueue.run_entries(60), 0)
+        reportqueue.join()
+
+    def test_003_run_entries_002(self):
+        reportqueue = threadqueue.ReportQueue(
+            maxsize=2, policy=threadqueue.COALESCE, coalescelimit=1000
+        )
+        log = []
+
+        def append_slowly(number):
+            time.sleep(0.001)
+            log.append(number)
+
+        def flood():
+            for number in range(3000):
+                reportqueue.put((append_slowly, (number,), {}))
+
+        thread = threading.Thread(target=flood)
+        thread.start()
+        try:
+            while thread.is_alive() or reportqueue.qsize():
+                self.assertLessEqual(reportqueue.qsize(), 2)
+                start = time.monotonic()
+                reportqueue.run_entries(0.02)
+                self.assertLess(time.monotonic() - start, 0.5)
+        finally:
+            thread.join()
+        reportqueue.run_entries(60)
+        self.assertEqual(log, list(range(3000)))
+        reportqueue.join()
+
+    def test_004_discard_entries_001(self):
+        reportqueue = threadqueue.ReportQueue(
+            maxsize=2, policy=threadqueue.COALESCE, coalescelimit=10
+        )
+        log = []
+        for number in range(20):
+            reportqueue.put((log.append, (number,), {}), block=False)
+        self.assertEqual(reportqueue.run_entries(0), 1)
+        reportqueue.put((log.extend, ("ab",), {}), block=False)
+        self.assertEqual(reportqueue.qsize(), 2)
+        self.assertEqual(reportqueue.discard_entries(), 3)
+        self.assertEqual(reportqueue.unfinished_tasks, 0)
+        self.assertEqual(reportqueue.run_entries(60), 0)
+        self.assertEqual(log, [0])
+        reportqueue.join()
+
+
+if __name__ == "__main__":
+    runner = unittest.TextTestRunner
+    loader = unittest.defaultTestLoader.loadTestsFromTestCase
+    runner().run(loader(ReportQueue))
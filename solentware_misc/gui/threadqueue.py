@@ -8,13 +8,188 @@ It extends the frame.AppSysFrame class which supports progress reports.
 
 """
 
+import os
 import queue
 import threading
+import time
+import tkinter
 
 from ..core import callthreadqueue
+from ..core import processqueue
+from ..core import eventloopthread
 
 from . import frame
 
+# Policies for a ReportQueue which is full.
+BLOCK = "block"  # wait for space
+DROP_OLDEST = "drop-oldest"  # discard the oldest entry
+COALESCE = "coalesce"  # merge consecutive entries for the same method
+
+
+def _call_each(method, calls):
+    """Call method(*args, **kwargs) for each (args, kwargs) in calls."""
+    for args, kwargs in calls:
+        method(*args, **kwargs)
+
+
+class ReportQueue(queue.Queue):
+    """Queue of user interface updates which can wake the main thread.
+
+    Entries are (method, args, kwargs) tuples.  The policy decides what
+    happens when the queue is full:
+
+    BLOCK - put waits for space as for queue.Queue.
+    DROP_OLDEST - the oldest entry is discarded and counted in dropped.
+    COALESCE - an entry for the same method as the last entry is added to
+    it, so a burst of log appends takes one place, otherwise put waits.
+    Entries are coalesced whether or not the queue is full, but an entry
+    holds at most coalescelimit calls: the next call starts a new entry
+    which counts against maxsize.
+
+    A byte is written to wakeup_fd, if not None, when an entry is put so a
+    file handler in the main thread can run the update without waiting for
+    the next poll of the queue.  Change wakeup_fd with mutex held so the
+    byte is not written to a file descriptor which has been closed.
+
+    """
+
+    def __init__(self, maxsize=0, policy=BLOCK, coalescelimit=1000):
+        """Delegate to superclass after checking policy.
+
+        maxsize - maximum number of entries, 0 means no limit.
+        policy - BLOCK, DROP_OLDEST, or COALESCE.
+        coalescelimit - maximum number of calls in a coalesced entry.
+
+        """
+        if policy not in (BLOCK, DROP_OLDEST, COALESCE):
+            raise ValueError(
+                "".join(
+                    ("ReportQueue policy ", repr(policy), " is not supported")
+                )
+            )
+        self.policy = policy
+        self.coalescelimit = coalescelimit
+        super().__init__(maxsize=maxsize)
+
+    def _init(self, maxsize):
+        """Delegate to superclass then note no wakeup file descriptor yet."""
+        super()._init(maxsize)
+        self.wakeup_fd = None
+        self.dropped = 0
+        self._partial = None
+
+    def _coalesce(self, item):
+        """Add item to last entry if both are for same method, return True.
+
+        Must be called with mutex held.
+
+        """
+        if self.policy != COALESCE or not self.queue:
+            return False
+        method, args, kwargs = item
+        last = self.queue[-1]
+        if last[0] is _call_each:
+            if last[1][0] != method:
+                return False
+            if len(last[1][1]) >= self.coalescelimit:
+                return False
+            last[1][1].append((args, kwargs))
+            return True
+        if last[0] != method:
+            return False
+        self.queue[-1] = (
+            _call_each,
+            (method, [(last[1], last[2]), (args, kwargs)]),
+            {},
+        )
+        return True
+
+    def put(self, item, block=True, timeout=None):
+        """Put item on queue by policy then write a byte to wakeup_fd if set.
+
+        The arguments are as for queue.Queue.put.
+
+        """
+        with self.mutex:
+            if self._coalesce(item):
+                done = True
+            elif (
+                self.policy == DROP_OLDEST
+                and 0 < self.maxsize <= self._qsize()
+            ):
+                # One entry replaces another so unfinished_tasks is unchanged.
+                self.queue.popleft()
+                self.dropped += 1
+                self._put(item)
+                self.not_empty.notify()
+                done = True
+            else:
+                done = False
+        if not done:
+            super().put(item, block=block, timeout=timeout)
+        with self.mutex:
+            if self.wakeup_fd is not None:
+                try:
+                    os.write(self.wakeup_fd, b"\0")
+                except OSError:
+                    # The pipe is full so a wakeup is pending already.
+                    pass
+
+    def run_entries(self, batchtime):
+        """Do queued calls for up to batchtime seconds and return number done.
+
+        batchtime - seconds allowed, but at least one call is done if any
+        are queued.
+
+        The calls in a coalesced entry not done by the deadline are done
+        first by the next run_entries call.  Only one thread, usually the
+        main thread, should call run_entries.
+        """
+        count = 0
+        deadline = time.monotonic() + batchtime
+        while count == 0 or time.monotonic() < deadline:
+            if self._partial is None:
+                try:
+                    method, args, kwargs = self.get_nowait()
+                except queue.Empty:
+                    return count
+                if method is not _call_each:
+                    method(*args, **kwargs)
+                    self.task_done()
+                    count += 1
+                    continue
+                self._partial = [args[0], args[1], 0]
+            partial = self._partial
+            method, calls = partial[:2]
+            while partial[2] < len(calls):
+                args, kwargs = calls[partial[2]]
+                partial[2] += 1
+                method(*args, **kwargs)
+                count += 1
+                if time.monotonic() >= deadline:
+                    break
+            if partial[2] == len(calls):
+                self._partial = None
+                self.task_done()
+        return count
+
+    def discard_entries(self):
+        """Remove all entries, including any partly done, and return count.
+
+        Only the thread calling run_entries should call discard_entries.
+        """
+        with self.mutex:
+            count = len(self.queue)
+            self.queue.clear()
+            if self._partial is not None:
+                self._partial = None
+                count += 1
+            self.unfinished_tasks -= count
+            if not self.unfinished_tasks:
+                self.all_tasks_done.notify_all()
+            self.not_full.notify_all()
+        return count
+
 
 class AppSysThreadQueue(frame.AppSysFrame):
     """Add thread task queue and UI update queue to frame.AppSysFrame class.
@@ -22,9 +197,16 @@ class AppSysThreadQueue(frame.AppSysFrame):
     Provide a background thread and associated queue for submitting tasks using
     a CallThreadQueue instance.  One background task can be run at a time.
     Requests to run a background task when one is already running are rejected.
+    The workers and queuesize arguments allow several background tasks to run
+    at the same time, and the processes argument runs them in other processes.
 
     Use a queue to pass user interface update requests to the main thread for
     execution.  (The background task can report progress to the task log.)
+    Where tkinter supports file handlers, so not on Microsoft Windows, each
+    request wakes the main thread through a pipe.  The queue is also polled,
+    frequently while requests are arriving and less often when idle.  The
+    requests are done in batches limited by time so a busy background task
+    does not make the user interface unresponsive.
 
     This means all user interface update calls have to be done as:
     do_ui_task(<method>, tuple, dictionary).
@@ -33,6 +215,13 @@ class AppSysThreadQueue(frame.AppSysFrame):
 
     Do <queue>.put((<method>, tuple, dictionary)) for other threads.
 
+    Coroutines can be run by an asyncio event loop in another thread, started
+    when run_coroutine is first called.
+
+    The task queue and event loop are stopped when the widget is destroyed.
+    Tasks still on the queue are cancelled but running tasks are allowed to
+    finish.
+
     """
 
     # Start of comments copied from chesstab.gui.chessdu on 2017-09-05.
@@ -55,42 +244,174 @@ class AppSysThreadQueue(frame.AppSysFrame):
 
     # End of comments copied from chesstab.gui.chessdu on 2017-09-05.
 
-    def __init__(self, interval=5000, **kargs):
+    def __init__(
+        self,
+        interval=5000,
+        workers=1,
+        queuesize=1,
+        processes=None,
+        mininterval=10,
+        reportsize=1000,
+        reportpolicy=COALESCE,
+        batchtime=50,
+        **kargs
+    ):
         """Delegate to superclass then create and start task.
 
-        Tasks are taken from a queue of maximum length 1.
+        Tasks are taken from a queue of maximum length 1 by default.
 
-        interval - poll report queue after a time delay (default 5 seconds).
+        interval - longest delay between polls of report queue when idle
+        (default 5 seconds).
+        workers - number of threads running tasks (default 1).
+        queuesize - maximum length of task queue, 0 means no limit.
+        processes - if not None run tasks in a pool of this many processes.
+        mininterval - delay between polls of report queue while requests are
+        arriving (default 10 milliseconds).  The delay doubles, up to
+        interval, each time the queue is found empty.
+        reportsize - maximum length of report queue, 0 means no limit.
+        reportpolicy - ReportQueue policy when report queue is full.
+        batchtime - milliseconds spent doing report queue requests before
+        the user interface is allowed to respond to events.
         **kargs - passed to superclass as **kargs argument.
         """
         super().__init__(**kargs)
-        self.queue = callthreadqueue.CallThreadQueue()
-        self.reportqueue = queue.Queue(maxsize=1)
-        self.__run_ui_task_from_queue(interval)
+        if processes is None:
+            self.queue = callthreadqueue.CallThreadQueue(
+                workers=workers, maxsize=queuesize
+            )
+        else:
+            self.queue = processqueue.ProcessCallQueue(
+                workers=workers, maxsize=queuesize, processes=processes
+            )
+        self.reportqueue = ReportQueue(maxsize=reportsize, policy=reportpolicy)
+        self.eventloop = None
+        self._wakeup_read_fd = None
+        self._batchtime = batchtime / 1000
+        self._maxinterval = interval
+        self._mininterval = mininterval
+        self.__watch_reportqueue()
+        self.get_widget().bind(
+            sequence="<Destroy>",
+            func=self.try_event(self.__stop_tasks),
+            add=True,
+        )
+        self.__run_ui_task_from_queue(mininterval)
+
+    def run_coroutine(self, coroutine, callback=None):
+        """Schedule coroutine on the event loop thread and return it's future.
+
+        coroutine - the coroutine to be run.
+        callback - called as callback(future) in the main thread, through
+        do_ui_task, when the coroutine is done.
+
+        The coroutine must use do_ui_task for user interface updates.
+        """
+        if self.eventloop is None:
+            self.eventloop = eventloopthread.EventLoopThread()
+        future = self.eventloop.put_coroutine(coroutine)
+        if callback is not None:
+            future.add_done_callback(
+                lambda done: self.do_ui_task(callback, (done,))
+            )
+        return future
 
     def get_reportqueue(self):
         """Return the report notification queue."""
         return self.reportqueue
 
+    def __watch_reportqueue(self):
+        """Wake main thread through a pipe when report queue gets an entry.
+
+        Nothing is done if tkinter does not support file handlers.  The file
+        handler is deleted and the pipe closed when the widget is destroyed.
+        """
+        widget = self.get_widget()
+        tk = widget.tk
+        if not hasattr(tk, "createfilehandler"):
+            return
+        read_fd, write_fd = os.pipe()
+        os.set_blocking(read_fd, False)
+        os.set_blocking(write_fd, False)
+        tk.createfilehandler(
+            read_fd,
+            tkinter.READABLE,
+            self.try_command(self.__wake_ui, widget),
+        )
+        self._wakeup_read_fd = read_fd
+        self.reportqueue.wakeup_fd = write_fd
+
+    def __unwatch_reportqueue(self):
+        """Delete the wakeup file handler and close the wakeup pipe.
+
+        Nothing is done if the pipe is closed already.
+        """
+        read_fd = self._wakeup_read_fd
+        if read_fd is None:
+            return
+        self._wakeup_read_fd = None
+        self.get_widget().tk.deletefilehandler(read_fd)
+        with self.reportqueue.mutex:
+            write_fd = self.reportqueue.wakeup_fd
+            self.reportqueue.wakeup_fd = None
+        os.close(read_fd)
+        os.close(write_fd)
+
+    def __stop_tasks(self, event=None):
+        """Stop the event loop and task queue then close the wakeup pipe.
+
+        event - the Destroy event for the widget, or None.
+
+        The report queue is emptied while waiting, because the widgets it
+        would update are being destroyed, so a task or coroutine waiting
+        for space on the report queue can finish.
+        """
+        if self.eventloop is not None:
+            while not self.eventloop.stop(timeout=0.1):
+                self.reportqueue.discard_entries()
+        while not self.queue.shutdown(timeout=0.1, cancel_pending=True):
+            self.reportqueue.discard_entries()
+        self.reportqueue.discard_entries()
+        self.__unwatch_reportqueue()
+
+    def __wake_ui(self, file, mask):
+        """Empty the wakeup pipe then do all queued tasks.
+
+        file - the file descriptor of the read end of the pipe.
+        mask - the tkinter file handler event mask.
+        """
+        try:
+            while os.read(file, 4096):
+                pass
+        except BlockingIOError:
+            pass
+        self.__do_ui_tasks()
+
+    def __do_ui_tasks(self):
+        """Do queued tasks for up to batchtime and return the number done.
+
+        Tasks not done, including the rest of a coalesced entry, are left
+        for the next poll, which will be soon because some tasks were done.
+        """
+        return self.reportqueue.run_entries(self._batchtime)
+
     def __run_ui_task_from_queue(self, interval):
-        """Do all queued tasks then poll the queue after interval.
+        """Do all queued tasks then poll the queue after a delay.
+
+        interval - delay since the previous poll.
 
-        interval - poll report queue after a time delay.
+        The next delay is mininterval if any tasks were done, otherwise
+        double interval but no more than the interval given when creating
+        the instance.
         """
-        while True:
-            try:
-                method, args, kwargs = self.reportqueue.get_nowait()
-                method(*args, **kwargs)
-            except queue.Empty:
-                self.get_widget().after(
-                    interval,
-                    self.try_command(
-                        self.__run_ui_task_from_queue, self.get_widget()
-                    ),
-                    *(interval,)
-                )
-                break
-            self.reportqueue.task_done()
+        if self.__do_ui_tasks():
+            interval = self._mininterval
+        else:
+            interval = min(interval * 2, self._maxinterval)
+        self.get_widget().after(
+            interval,
+            self.try_command(self.__run_ui_task_from_queue, self.get_widget()),
+            *(interval,)
+        )
 
     def do_ui_task(self, method, args=(), kwargs=None):
         """Run method on main thread or add to queue on other threads.